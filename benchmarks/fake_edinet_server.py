@@ -0,0 +1,226 @@
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# EDINET API v2 の documents.json と documents/{docID} を模したローカルサーバ
+# 書類一覧と CSV の zip は日付と docID から決定的に生成する
+
+TSV_HEADER = ["要素ID", "項目名", "コンテキストID", "相対年度", "連結・個別", "期間・時点", "ユニットID", "単位", "値"]
+
+ELEMENTS = [
+    ("jppfs_cor:NetSales", "売上高", "JPY", "円"),
+    ("jppfs_cor:CostOfSales", "売上原価", "JPY", "円"),
+    ("jppfs_cor:GrossProfit", "売上総利益", "JPY", "円"),
+    ("jppfs_cor:OperatingIncome", "営業利益", "JPY", "千円"),
+    ("jppfs_cor:OrdinaryIncome", "経常利益", "JPY", "千円"),
+    ("jppfs_cor:ProfitLoss", "当期純利益", "JPY", "百万円"),
+    ("jppfs_cor:Assets", "資産", "JPY", "円"),
+    ("jppfs_cor:NetAssets", "純資産", "JPY", "円"),
+    ("jpcrp_cor:NumberOfEmployees", "従業員数", "pure", "人"),
+    ("jpcrp_cor:TotalNumberOfIssuedSharesSummaryOfBusinessResults", "発行済株式総数", "shares", "株"),
+]
+
+CONTEXTS = [
+    ("CurrentYearDuration", "当期", "期間"),
+    ("Prior1YearDuration", "前期", "期間"),
+    ("CurrentYearInstant", "当期末", "時点"),
+    ("Prior1YearInstant", "前期末", "時点"),
+]
+
+# 書類種別ごとの CSV のプレフィックスと、書類一覧に現れる割合
+DOC_TYPES = {
+    "120": ("jpcrp030000-asr", 0.3),
+    "140": ("jpcrp040300-q1r", 0.3),
+    "160": ("jpcrp050000-ssr", 0.1),
+    "030": (None, 0.3),
+}
+
+DOC_ID_PATTERN = re.compile(r"^S(\d{8})(\d{4})$")
+
+
+class FakeEdinetSettings:
+    def __init__(self, companies: int = 100, docs_per_day: int = 50, rows_per_doc: int = 600,
+                 latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        self.companies = companies
+        self.docs_per_day = docs_per_day
+        self.rows_per_doc = rows_per_doc
+        # 1リクエストごとの応答遅延（秒）
+        self.latency = latency
+        # error_rate の割合で error_status を返す
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+
+
+def build_document(settings: FakeEdinetSettings, target_date: str, index: int) -> dict:
+    rng = random.Random(f"{settings.seed}-{target_date}-{index}")
+    doc_type_code = rng.choices(list(DOC_TYPES), weights=[weight for _, weight in DOC_TYPES.values()])[0]
+    edinet_code = f"E{rng.randrange(settings.companies):05d}"
+    return {
+        "seqNumber": index + 1,
+        "docID": f"S{target_date.replace('-', '')}{index:04d}",
+        "edinetCode": edinet_code,
+        "secCode": f"{rng.randrange(1000, 9999)}0",
+        "JCN": f"{rng.randrange(10 ** 12, 10 ** 13)}",
+        "filerName": f"株式会社ベンチマーク{edinet_code}",
+        "fundCode": None,
+        "ordinanceCode": "010",
+        "formCode": "030000",
+        "docTypeCode": doc_type_code,
+        "periodStart": None,
+        "periodEnd": None,
+        "submitDateTime": f"{target_date} {9 + index % 8:02d}:00",
+        "docDescription": f"書類{doc_type_code}",
+        "issuerEdinetCode": None,
+        "subjectEdinetCode": None,
+        "subsidiaryEdinetCode": None,
+        "currentReportReason": None,
+        "parentDocID": None,
+        "opeDateTime": None,
+        "withdrawalStatus": "0",
+        "docInfoEditStatus": "0",
+        "disclosureStatus": "0",
+        "xbrlFlag": "1",
+        "pdfFlag": "1",
+        "attachDocFlag": "1",
+        "englishDocFlag": "0",
+        "csvFlag": "1",
+        "legalStatus": "1",
+    }
+
+
+def build_document_list(settings: FakeEdinetSettings, target_date: str) -> dict:
+    results = [build_document(settings, target_date, index) for index in range(settings.docs_per_day)]
+    return {
+        "metadata": {
+            "title": "提出された書類を把握するためのAPI",
+            "parameter": {"date": target_date, "type": "2"},
+            "resultset": {"count": len(results)},
+            "processDateTime": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "status": "200",
+            "message": "OK",
+        },
+        "results": results,
+    }
+
+
+def build_tsv(settings: FakeEdinetSettings, rng: random.Random) -> bytes:
+    lines = ["\t".join(f'"{column}"' for column in TSV_HEADER)]
+    for i in range(settings.rows_per_doc):
+        if i < len(ELEMENTS) * len(CONTEXTS):
+            element_id, item_name, unit_id, unit = ELEMENTS[i % len(ELEMENTS)]
+            context_id, relative_year, period_type = CONTEXTS[i // len(ELEMENTS)]
+        else:
+            # 主要な要素以外は提出者ごとの拡張要素として埋める
+            element_id, item_name, unit_id, unit = (f"jpcrp030000-asr_E00000-000:Extension{i}", f"拡張項目{i}", "JPY", "円")
+            context_id, relative_year, period_type = CONTEXTS[i % len(CONTEXTS)]
+        value = rng.choice([f"{rng.randrange(10 ** 9):,}", str(rng.randrange(10 ** 9)), f"△{rng.randrange(10 ** 6):,}", "－", "テキスト"])
+        lines.append("\t".join(f'"{column}"' for column in [element_id, item_name, context_id, relative_year, "連結", period_type, unit_id, unit, value]))
+    return ("\n".join(lines) + "\n").encode("utf-16-le")
+
+
+@lru_cache(maxsize=1024)
+def build_document_zip(settings: FakeEdinetSettings, doc_id: str) -> bytes:
+    match = DOC_ID_PATTERN.match(doc_id)
+    if not match:
+        return None
+    target_date = datetime.strptime(match.group(1), "%Y%m%d")
+    document = build_document(settings, target_date.strftime("%Y-%m-%d"), int(match.group(2)))
+    prefix, _ = DOC_TYPES[document["docTypeCode"]]
+    if prefix is None:
+        return None
+
+    rng = random.Random(f"{settings.seed}-{doc_id}")
+    fiscal_year = (target_date - timedelta(days=80)).strftime("%Y-%m-%d")
+    submit_date = target_date.strftime("%Y-%m-%d")
+    member_suffix = f"001_{document['edinetCode']}-000_{fiscal_year}_01_{submit_date}.csv"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        # 実際の zip と同じく監査報告書のCSVが先に並ぶ
+        zip_file.writestr(f"XBRL_TO_CSV/jpaud-aar-cn-{member_suffix}", build_tsv(FakeEdinetSettings(rows_per_doc=5), rng))
+        zip_file.writestr(f"XBRL_TO_CSV/{prefix}-{member_suffix}", build_tsv(settings, rng))
+    return buffer.getvalue()
+
+
+class FakeEdinetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        settings = self.server.settings
+        if settings.latency:
+            time.sleep(settings.latency)
+        self.server.count_request()
+        if settings.error_rate and random.random() < settings.error_rate:
+            self.send_body(settings.error_status, b'{"metadata": {"status": "error"}}', "application/json")
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/documents.json"):
+            target_date = query.get("date", [""])[0]
+            body = json.dumps(build_document_list(settings, target_date), ensure_ascii=False).encode("utf-8")
+            self.send_body(200, body, "application/json; charset=utf-8")
+            return
+        if "/documents/" in url.path:
+            doc_id = url.path.rsplit("/", 1)[-1]
+            body = build_document_zip(settings, doc_id) if query.get("type", ["1"])[0] == "5" else None
+            if body is None:
+                self.send_body(404, b'{"metadata": {"status": "404"}}', "application/json")
+                return
+            self.send_body(200, body, "application/octet-stream")
+            return
+        self.send_body(404, b"", "text/plain")
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeEdinetServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: FakeEdinetSettings, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), FakeEdinetHandler)
+        self.settings = settings
+        self.request_count = 0
+        self.request_count_lock = threading.Lock()
+        self.thread = None
+
+    def count_request(self):
+        with self.request_count_lock:
+            self.request_count += 1
+
+    @property
+    def base_url(self) -> str:
+        # config.EDINET_BASE_URL と同じ形式
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v2/{{url_path}}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeEdinetServer(FakeEdinetSettings(), port=8765).start()
+    print(server.base_url)
+    server.thread.join()
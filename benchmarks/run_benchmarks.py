@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# ローカルの EDINET API スタンドインに対して取り込み処理を計測する
+# 使い方: python -m benchmarks.run_benchmarks --scales small medium --latency 0.05 --error-rate 0.01
+# 各スケールは別プロセスで実行し、ピークメモリ (ru_maxrss) がスケールごとに分かれるようにする
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {
+    "small": {"days": 3, "docs_per_day": 20, "rows_per_doc": 300, "companies": 20},
+    "medium": {"days": 10, "docs_per_day": 50, "rows_per_doc": 600, "companies": 100},
+    "large": {"days": 30, "docs_per_day": 100, "rows_per_doc": 1200, "companies": 300},
+}
+
+LOOKUP_ELEMENT_ID = "jppfs_cor:NetSales"
+MAX_LOOKUPS = 200
+
+
+def peak_rss_mb() -> float:
+    # Linux の ru_maxrss はKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stage_seconds(metrics) -> dict:
+    totals = {}
+    for histogram in metrics.snapshot()["histograms"]:
+        if histogram["name"] == "stage_seconds":
+            stage = histogram["labels"]["stage"]
+            totals[stage] = round(totals.get(stage, 0) + histogram["sum"], 4)
+    return totals
+
+
+def run_scale(scale_name: str, base_url: str, work_path: str, requests_per_second: float) -> dict:
+    # 子プロセス側で実行する。config は環境変数を読んでから上書きする
+    sys.path.insert(0, ROOT_PATH)
+    import config
+    config.EDINET_BASE_URL = base_url
+    config.EDINET_DB = os.path.join(work_path, "edinet.db")
+    config.EDINET_HDF5 = os.path.join(work_path, "edinet.h5")
+    config.DOWNLOAD_PATH = work_path
+    config.CACHE_PATH = None
+    config.RATE_LIMIT_STATE_PATH = os.path.join(work_path, "rate_limit")
+    from src.utils.edinet_utils import EdinetUtils
+    from src.utils.metrics_utils import get_metrics
+
+    scale = SCALES[scale_name]
+    edinet_utils = EdinetUtils(requests_per_second=requests_per_second)
+    results = {"scale": scale_name, **scale}
+
+    start_time = time.perf_counter()
+    failed_dates = edinet_utils.save_all_document_list(days=scale["days"])
+    elapsed = time.perf_counter() - start_time
+    listed_docs = scale["docs_per_day"] * (scale["days"] - len(failed_dates))
+    results["save_all_document_list"] = {
+        "seconds": round(elapsed, 3),
+        "docs": listed_docs,
+        "docs_per_sec": round(listed_docs / elapsed, 1),
+        "failed_dates": len(failed_dates),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    target_date_end = time.strftime("%Y-%m-%d")
+    target_date_start = time.strftime("%Y-%m-%d", time.localtime(time.time() - scale["days"] * 86400))
+    documents = edinet_utils.get_doc_id_list("all", target_date_start, target_date_end, ["120", "140", "160"])
+    start_time = time.perf_counter()
+    combined_df = edinet_utils.get_securities_report_by_edinet_code("all", target_date_start, target_date_end, documents=documents)
+    elapsed = time.perf_counter() - start_time
+    results["get_securities_report_by_edinet_code"] = {
+        "seconds": round(elapsed, 3),
+        "docs": len(documents),
+        "rows": len(combined_df),
+        "docs_per_sec": round(len(documents) / elapsed, 1),
+        "rows_per_sec": round(len(combined_df) / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    start_time = time.perf_counter()
+    edinet_utils.save_securities_report_to_db(combined_df)
+    elapsed = time.perf_counter() - start_time
+    results["save_securities_report_to_db"] = {
+        "seconds": round(elapsed, 3),
+        "rows": len(combined_df),
+        "rows_per_sec": round(len(combined_df) / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    lookups = combined_df[["edinetCode", "fiscalYear"]].drop_duplicates().head(MAX_LOOKUPS).itertuples(index=False)
+    lookup_count = 0
+    found_rows = 0
+    start_time = time.perf_counter()
+    for edinet_code, fiscal_year in lookups:
+        found_rows += len(edinet_utils.get_by_element_id(LOOKUP_ELEMENT_ID, fiscal_year, edinet_code))
+        lookup_count += 1
+    elapsed = time.perf_counter() - start_time
+    results["get_by_element_id"] = {
+        "seconds": round(elapsed, 3),
+        "queries": lookup_count,
+        "rows": found_rows,
+        "queries_per_sec": round(lookup_count / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    edinet_utils.close()
+    results["stage_seconds"] = stage_seconds(get_metrics())
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return results
+
+
+def run_child(scale_name: str, base_url: str, requests_per_second: float, quiet: bool) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"edinet_benchmark_{scale_name}_") as work_path:
+        env = dict(os.environ)
+        env["LOG_PATH"] = work_path
+        env["LOG_QUEUE"] = "1"
+        command = [
+            sys.executable, "-m", "benchmarks.run_benchmarks", "--child",
+            "--scales", scale_name, "--base-url", base_url, "--work-path", work_path,
+            "--requests-per-second", str(requests_per_second),
+        ]
+        completed = subprocess.run(command, cwd=ROOT_PATH, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL if quiet else None, check=True)
+        return json.loads(completed.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルの EDINET API スタンドインで取り込み処理を計測する")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(SCALES))
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストごとの応答遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラー応答を返す割合")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--requests-per-second", type=float, default=0, help="0 の場合はレート制限しない")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--verbose", action="store_true", help="取り込み処理のログを表示する")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--work-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scale(args.scales[0], args.base_url, args.work_path, args.requests_per_second), ensure_ascii=False))
+        return
+
+    from benchmarks.fake_edinet_server import FakeEdinetServer, FakeEdinetSettings
+
+    all_results = []
+    for scale_name in args.scales:
+        scale = SCALES[scale_name]
+        settings = FakeEdinetSettings(
+            companies=scale["companies"], docs_per_day=scale["docs_per_day"], rows_per_doc=scale["rows_per_doc"],
+            latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+        )
+        server = FakeEdinetServer(settings).start()
+        try:
+            results = run_child(scale_name, server.base_url, args.requests_per_second, quiet=not args.verbose)
+        finally:
+            server.stop()
+        results["requests"] = server.request_count
+        results["latency"] = args.latency
+        results["error_rate"] = args.error_rate
+        all_results.append(results)
+
+        print(f"[{scale_name}] peak RSS: {results['peak_rss_mb']} MB, requests: {results['requests']}")
+        for step in ["save_all_document_list", "get_securities_report_by_edinet_code", "save_securities_report_to_db", "get_by_element_id"]:
+            print(f"  {step}: {results[step]}")
+        print(f"  stage_seconds: {results['stage_seconds']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,93 @@ EDINET_BASE_URL = 'https://api.edinet-fsa.go.jp/api/v2/{url_path}'
 EDINET_DOC_INFO_URL_PATH = 'documents.json'
 EDINET_DOC_URL_PATH = 'documents/{doc_id}'
 EDINET_DB = 'data/edinet.db'
+# 書類一覧のHDF5ストア（1つのテーブルに追記する）
+EDINET_HDF5 = 'data/edinet.h5'
+EDINET_HDF5_KEY = 'document_list'
+EDINET_HDF5_DATA_COLUMNS = ['docID', 'submitDateTime', 'edinetCode', 'docTypeCode']
+EDINET_HDF5_CHUNK_SIZE = 100000
+# 文字列カラムの最大バイト数（未指定のカラムは64）
+EDINET_HDF5_MIN_ITEMSIZE = {
+    'filerName': 512,
+    'docDescription': 1024,
+    'currentReportReason': 1024,
+    # カンマ区切りで複数のEDINETコードが入る列
+    'issuerEdinetCode': 1024,
+    'subjectEdinetCode': 1024,
+    'subsidiaryEdinetCode': 1024,
+}
+# タクソノミのExcelを解析した結果のキャッシュ
+TAXONOMY_CACHE_PATH = 'data/taxonomy_cache'
+# 有価証券報告書データのParquetデータセットの保存先
+PARQUET_PATH = 'data/securities_report'
 
 DOWNLOAD_PATH = os.getenv('DOWNLOAD_PATH')
 LOG_PATH = os.getenv('LOG_PATH')
+# 1の場合はログをキューに積み、共有の書き込みスレッドでまとめて出力する
+LOG_QUEUE = os.getenv('LOG_QUEUE', '0') == '1'
+# 書類ごとのログは同じ種類のものを LOG_SAMPLE_EVERY 件に1件だけ出力する
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 1))
+# 処理時間などのメトリクスの出力先（.prom の場合は Prometheus 形式、未設定の場合は出力しない）
+METRICS_PATH = os.getenv('METRICS_PATH')
+METRICS_DUMP_INTERVAL = 60
+# 一括処理のプロファイル（"cprofile" または "sample"、未設定の場合は無効）
+PROFILE = os.getenv('PROFILE')
+PROFILE_SAMPLE_INTERVAL = 0.01
+# ダウンロードした書類のキャッシュ（未設定の場合は無効）
+CACHE_PATH = os.getenv('CACHE_PATH')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 10 * 1024 ** 3))
+
+# 書類一覧APIの並列取得設定
+EDINET_MAX_WORKERS = 4
+EDINET_REQUESTS_PER_SECOND = 2.0
+# APIのレート制限。書類一覧と書類取得で別々に管理し、状態はプロセス間で共有する
+RATE_LIMIT_STATE_PATH = os.getenv('RATE_LIMIT_STATE_PATH', 'data/rate_limit')
+RATE_LIMITS = {
+    'metadata': {'min_rate': 0.2, 'max_rate': 5.0, 'burst': 2},
+    'download': {'min_rate': 0.2, 'max_rate': 5.0, 'burst': 4},
+}
+# 429/503 を受けたらレートを RATE_LIMIT_BACKOFF 倍にし、RATE_LIMIT_RAMP_UP_AFTER 回続けて成功したら RATE_LIMIT_RAMP_UP_STEP だけ上げる
+RATE_LIMIT_BACKOFF = 0.5
+RATE_LIMIT_RAMP_UP_AFTER = 20
+RATE_LIMIT_RAMP_UP_STEP = 0.1
+# この秒数より古い状態は引き継がずに初期値から始める
+RATE_LIMIT_STATE_TTL = 600
+EDINET_FETCH_RETRIES = 3
+# HTTPクライアントの設定
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+HTTP_MAX_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 1.0
+HTTP_BACKOFF_JITTER = 0.5
+# (接続タイムアウト, 読み込みタイムアウト) 秒
+HTTP_TIMEOUT = (10, 60)
+# 有価証券報告書CSVの取得パイプラインの設定
+DOWNLOAD_WORKERS = 4
+PARSE_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 8
+# CSV解析に使うプロセス数（0の場合は解析スレッド上で実行）
+PARSE_PROCESSES = 0
+# 解析プロセスの起動方法（forkserver または spawn。forkserver を使えない環境では spawn）
+PARSE_START_METHOD = 'forkserver'
+# ダウンロード時の読み込み単位と、メモリ上に保持する上限サイズ
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+# SQLiteの接続ごとに設定するPRAGMA
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,
+}
+# 有価証券報告書データを正規化したスキーマ（ディメンションテーブル＋ビュー）で保存するか
+NORMALIZED_SCHEMA = os.getenv('NORMALIZED_SCHEMA', '0') == '1'
+# DBへの一括書き込み時のチャンクサイズ
+DB_WRITE_CHUNK_SIZE = 5000
+# 一括取り込みで失敗した書類を再試行する上限回数
+INGEST_MAX_ATTEMPTS = 3
+# 差分同期時に再取得する日数（訂正・取下げの反映用）
+EDINET_SYNC_RECHECK_DAYS = 7
 
 DOCUMENT_TYPES = {
     "010": "有価証券通知書",
@@ -66,3 +150,14 @@ DOWNLOAD_TYPES = {
     5: ".csv.zip"
 
 }
+
+# 単位ごとの (基本単位, 倍率)
+UNIT_SCALES = {
+    "千円": ("円", 1e3),
+    "百万円": ("円", 1e6),
+    "億円": ("円", 1e8),
+    "十億円": ("円", 1e9),
+    "千株": ("株", 1e3),
+    "百万株": ("株", 1e6),
+    "千人": ("人", 1e3),
+}
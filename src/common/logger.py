@@ -1,42 +1,115 @@
+import atexit
 import logging
 import os
+import queue
+import threading
 import time
 import uuid
+from logging.handlers import QueueHandler, QueueListener
 import config
 
+# キューモードでは log_prefix ごとに1つのキューと書き込みスレッドをプロセス内で共有する
+_queue_handlers = {}
+_queue_listeners = []
+_queue_lock = threading.Lock()
+# キューを使わない場合のハンドラ。(ロガー名, log_prefix) ごとに共有する
+_file_handlers = {}
+_file_handlers_lock = threading.Lock()
+
+
+def _create_handlers(log_file: str) -> list[logging.Handler]:
+    # ログのフォーマットを設定
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # コンソールハンドラの設定
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    # ファイルハンドラの設定
+    log_path = config.LOG_PATH
+    log_file_path = os.path.join(log_path, log_file)
+    file_handler = logging.FileHandler(log_file_path)
+    file_handler.setFormatter(formatter)
+    return [console_handler, file_handler]
+
+
+def _get_queue_handler(log_prefix: str) -> QueueHandler:
+    with _queue_lock:
+        if log_prefix not in _queue_handlers:
+            current_unix_time = int(time.time())
+            generated_uuid = uuid.uuid4().hex
+            log_file = f'{log_prefix}_{current_unix_time}_{generated_uuid}.log'
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, *_create_handlers(log_file), respect_handler_level=True)
+            listener.start()
+            _queue_listeners.append(listener)
+            _queue_handlers[log_prefix] = QueueHandler(log_queue)
+        return _queue_handlers[log_prefix]
 
-class SimpleLogger:
-    def __init__(self, name, level=logging.INFO, log_prefix='log'):
-        self.logger = logging.getLogger(name)
-        self.logger.setLevel(level)
 
-        # ログのフォーマットを設定
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+def _get_file_handlers(name: str, log_prefix: str) -> list[logging.Handler]:
+    # 同じ名前のロガーはハンドラを使い回し、インスタンスを作るたびにログファイルを増やさない
+    with _file_handlers_lock:
+        if (name, log_prefix) not in _file_handlers:
+            current_unix_time = int(time.time())
+            generated_uuid = uuid.uuid4().hex
+            log_file = f'{log_prefix}_{name}_{current_unix_time}_{generated_uuid}.log'
+            _file_handlers[(name, log_prefix)] = _create_handlers(log_file)
+        return _file_handlers[(name, log_prefix)]
 
-        # コンソールハンドラの設定
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
 
-        current_unix_time = int(time.time())
-        generated_uuid = uuid.uuid4().hex
-        log_file = f'{log_prefix}_{name}_{current_unix_time}_{generated_uuid}.log'
-        # ファイルハンドラの設定
-        log_path = config.LOG_PATH
-        log_file_path = os.path.join(log_path, log_file)
-        file_handler = logging.FileHandler(log_file_path)
-        file_handler.setFormatter(formatter)
+def stop_queue_listeners():
+    # キューに残っているログを書き出してから書き込みスレッドを止める
+    with _queue_lock:
+        for listener in _queue_listeners:
+            listener.stop()
+        _queue_listeners.clear()
+        _queue_handlers.clear()
 
-        # 重複したハンドラが追加されないようにする
-        self.logger.handlers.clear()
 
-        # ハンドラをロガーに追加
-        self.logger.addHandler(console_handler)
-        self.logger.addHandler(file_handler)
+atexit.register(stop_queue_listeners)
+
+
+class SimpleLogger:
+    def __init__(self, name, level=logging.INFO, log_prefix='log', use_queue=None):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.sample_counts = {}
+        self.sample_lock = threading.Lock()
+
+        if config.LOG_QUEUE if use_queue is None else use_queue:
+            # 呼び出し元のスレッドではキューに積むだけにし、書き出しは共有の書き込みスレッドで行う
+            handlers = [_get_queue_handler(log_prefix)]
+            self.logger.propagate = False
+        else:
+            handlers = _get_file_handlers(name, log_prefix)
+
+        # 設定済みのロガーはそのまま使い、重複したハンドラが追加されないようにする
+        if self.logger.handlers != handlers:
+            self.logger.handlers.clear()
+            # ハンドラをロガーに追加
+            for handler in handlers:
+                self.logger.addHandler(handler)
         
     
     def debug(self, message):
         self.logger.debug(message)
 
+    def info_sampled(self, message, key=None, every=None):
+        # 書類ごとのログなど件数の多いものは、同じキーで every 件に1件だけ出力する
+        every = every or config.LOG_SAMPLE_EVERY
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        key = key or message
+        with self.sample_lock:
+            count = self.sample_counts.get(key, 0) + 1
+            self.sample_counts[key] = count
+        if (count - 1) % every != 0:
+            return
+        if every > 1:
+            message = f"{message} (sampled 1/{every}, count: {count})"
+        self.logger.info(message)
+
     def info(self, message):
         self.logger.info(message)
 
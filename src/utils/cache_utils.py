@@ -0,0 +1,79 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from shutil import copyfileobj
+import config
+
+
+class DocumentCache:
+    # docID とダウンロード種別をキーに書類ファイルを保存し、上限を超えたら最近使われていないものから削除する
+    def __init__(self, cache_path: str, max_bytes: int):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_path, exist_ok=True)
+
+        # 既存のキャッシュを最終利用時刻の古い順に読み込む
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        files = []
+        for file_name in os.listdir(cache_path):
+            file_path = os.path.join(cache_path, file_name)
+            if file_name.startswith('.') or not os.path.isfile(file_path):
+                continue
+            stat = os.stat(file_path)
+            files.append((stat.st_mtime, file_name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            self.entries[file_name] = size
+            self.total_bytes += size
+        with self.lock:
+            self._evict()
+
+    def _file_name(self, doc_id: str, download_type: int) -> str:
+        return f"{doc_id}{config.DOWNLOAD_TYPES[download_type]}"
+
+    def get(self, doc_id: str, download_type: int) -> str:
+        file_name = self._file_name(doc_id, download_type)
+        file_path = os.path.join(self.cache_path, file_name)
+        with self.lock:
+            if file_name not in self.entries:
+                return None
+            if not os.path.exists(file_path):
+                self.total_bytes -= self.entries.pop(file_name)
+                return None
+            self.entries.move_to_end(file_name)
+            os.utime(file_path)
+        return file_path
+
+    def put(self, doc_id: str, download_type: int, source) -> str:
+        # source にはファイルパスと読み込み可能なバッファのどちらも渡せる
+        file_name = self._file_name(doc_id, download_type)
+        file_path = os.path.join(self.cache_path, file_name)
+        temp_path = os.path.join(self.cache_path, f".{file_name}.{uuid.uuid4().hex}")
+        with open(temp_path, 'wb') as f:
+            if hasattr(source, 'read'):
+                copyfileobj(source, f, length=config.DOWNLOAD_CHUNK_SIZE)
+            else:
+                with open(source, 'rb') as src:
+                    copyfileobj(src, f, length=config.DOWNLOAD_CHUNK_SIZE)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, file_path)
+
+        with self.lock:
+            if file_name in self.entries:
+                self.total_bytes -= self.entries.pop(file_name)
+            self.entries[file_name] = size
+            self.total_bytes += size
+            self._evict()
+        return file_path
+
+    def _evict(self):
+        # 直前に追加したものは残す
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            file_name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_path, file_name))
+            except FileNotFoundError:
+                pass
@@ -3,134 +3,335 @@ import os
 import config
 from datetime import datetime, timedelta
 import pandas as pd
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from sqlalchemy import Integer, text
 from sqlalchemy.ext.declarative import declarative_base
-import time
-import uuid
+import threading
 import tempfile
 import re
-import numpy as np
-from shutil import copyfileobj
+import multiprocessing
+import pyarrow as pa
+from shutil import copyfileobj, copyfile
 from zipfile import ZipFile
 from src.common.logger import SimpleLogger
-from src.utils.sql_utils import SqlUtils, DocumentListTable, SecuritiesReportTable, EdinetcodeTable
+from src.utils.sql_utils import SqlUtils, DocumentListTable, SecuritiesReportTable, EdinetcodeTable, SyncStateTable, IngestJobTable, SecuritiesReportFactTable, LatestFactTable, DIMENSION_TABLES, get_securities_report_model, get_engine, df_to_records, refresh_latest_facts, lookup_dimension_keys
+from src.utils.http_utils import get_http_client, get_rate_limiter
+from src.utils.pipeline_utils import run_staged_pipeline
+from src.utils.cache_utils import DocumentCache
+from src.utils.parquet_utils import ParquetFactStore
+from src.utils.taxonomy_utils import get_taxonomy_loader
+from src.utils.search_utils import LabelSearchIndex
+from src.utils.metrics_utils import get_metrics, profiled
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from io import BytesIO
 
+def parse_tsv_member(data: bytes) -> bytes:
+    # プロセスプール上で実行するため、pickle の重い object 配列ではなく Arrow IPC のバイト列で返す
+    target_df = pd.read_csv(BytesIO(data), encoding='utf-16-le', sep='\t')
+    table = pa.Table.from_pandas(target_df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def read_parsed_member(data: bytes) -> pd.DataFrame:
+    # parse_tsv_member の戻り値を DataFrame に戻す
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+# 全角の数字・記号を半角に変換するテーブル
+NUMERIC_TRANSLATION = str.maketrans('０１２３４５６７８９，．－−', '0123456789,.--')
+
+
+def add_numeric_values(combined_df: pd.DataFrame) -> pd.DataFrame:
+    # 値の文字列を数値に変換し、単位の倍率を掛けて基本単位にそろえる
+    # "1,234" → 1234、"△500" → -500、"－" → NaN、"千円" → 円 ×1000
+    values = combined_df['value'].astype(str).str.strip().str.translate(NUMERIC_TRANSLATION)
+    values = values.str.replace(',', '', regex=False).str.replace(r'^[△▲]', '-', regex=True)
+    numeric_values = pd.to_numeric(values, errors='coerce')
+
+    units = combined_df['unit']
+    scales = units.map({unit: scale for unit, (_, scale) in config.UNIT_SCALES.items()}).fillna(1)
+    combined_df = combined_df.copy()
+    combined_df['numericValue'] = numeric_values * scales
+    combined_df['normalizedUnit'] = units.map({unit: normalized_unit for unit, (normalized_unit, _) in config.UNIT_SCALES.items()}).fillna(units)
+    return combined_df
+
+
 class EdinetUtils:
 
-    def __init__(self):
+    def __init__(self, requests_per_second: float = config.EDINET_REQUESTS_PER_SECOND):
         self.logger = SimpleLogger(__class__.__name__)
         self.logger.info("EdinetUtils init")
-
-    def get_data_from_edinet(self, url_path: str, params: dict) -> dict :
+        # 全てのAPI呼び出しで共有するレートリミッタ。requests_per_second は初期レート
+        self.rate_limiters = {
+            budget: get_rate_limiter(budget, requests_per_second) for budget in config.RATE_LIMITS
+        } if requests_per_second else None
+        self.http_client = get_http_client()
+        self.document_cache = DocumentCache(config.CACHE_PATH, config.CACHE_MAX_BYTES) if config.CACHE_PATH else None
+        self.parse_executor = None
+        self.parse_executor_lock = threading.Lock()
+        self.metrics = get_metrics()
+        # 書類ごとに状態を更新するため、ingest_job_table のマネージャはDBごとに1つだけ作る
+        self.ingest_job_managers = {}
+
+    def get_parse_executor(self, parse_processes: int) -> ProcessPoolExecutor:
+        # 一括処理の間は同じプロセスプールを使い回す
+        with self.parse_executor_lock:
+            if self.parse_executor is None:
+                # 解析スレッドから fork すると子プロセスがロックを握ったまま固まることがあるため、fork は使わない
+                start_method = config.PARSE_START_METHOD if config.PARSE_START_METHOD in multiprocessing.get_all_start_methods() else "spawn"
+                self.logger.info(f"start parse executor, processes: {parse_processes}, start_method: {start_method}")
+                self.parse_executor = ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context(start_method))
+            return self.parse_executor
+
+    def close(self):
+        with self.parse_executor_lock:
+            if self.parse_executor is not None:
+                self.parse_executor.shutdown()
+                self.parse_executor = None
+
+    def get_data_from_edinet(self, url_path: str, params: dict, stream: bool = False) -> requests.Response:
         EDINET_BASE_URL = config.EDINET_BASE_URL
         url = EDINET_BASE_URL.format(url_path=url_path)
         params['Subscription-Key'] = config.EDINET_KEY
 
-        response = requests.get(url, params=params)
+        rate_limiter = None
+        if self.rate_limiters:
+            rate_limiter = self.rate_limiters["metadata" if url_path == config.EDINET_DOC_INFO_URL_PATH else "download"]
+            rate_limiter.acquire()
+        # stream=True の場合はヘッダを受け取るまでの時間になる
+        with self.metrics.timer("fetch", endpoint=url_path.split('/')[0]):
+            response = self.http_client.get(url, params=params, stream=stream)
+        self.metrics.increment("http_responses_total", endpoint=url_path.split('/')[0], status_code=response.status_code)
+        if rate_limiter:
+            rate_limiter.observe(response)
         return response
-    
-    def save_all_document_list(self, days: int = 3, doc_info_type=2):
+
+    def get_document_list(self, target_date: str, doc_info_type=2):
+        params = {
+            'date': target_date,
+            'type': doc_info_type
+        }
+        try:
+            response = self.get_data_from_edinet(config.EDINET_DOC_INFO_URL_PATH, params)
+            if response.status_code != 200:
+                self.logger.error(f"get doc info failed, current target_date:{target_date}, status_code:{response.status_code}")
+                return None
+            # 途中で切れた応答やHTMLのエラーページも失敗した日付として再取得の対象にする
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.error(f"get doc info failed, current target_date:{target_date}, error:{e}")
+            return None
+
+    def fetch_document_lists(self, target_dates: list[str], doc_info_type=2, max_workers: int = 1, max_retries: int = config.EDINET_FETCH_RETRIES) -> tuple:
+        self.logger.info("start: fetch_document_lists")
+        results = {}
+        pending_dates = list(target_dates)
+        for attempt in range(max_retries + 1):
+            if not pending_dates:
+                break
+            if attempt > 0:
+                self.logger.info(f"retry failed dates: {len(pending_dates)}, attempt: {attempt}")
+            failed_dates = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(self.get_document_list, target_date, doc_info_type): target_date for target_date in pending_dates}
+                for count, future in enumerate(as_completed(futures)):
+                    target_date = futures[future]
+                    document_list = future.result()
+                    if document_list is None:
+                        failed_dates.append(target_date)
+                    else:
+                        results[target_date] = document_list
+                    if count % 10 == 0:
+                        self.logger.info(f"get doc info executed days: {count + 1}, current target_date:{target_date}")
+            pending_dates = sorted(failed_dates, reverse=True)
+
+        if pending_dates:
+            self.logger.error(f"get doc info failed dates: {pending_dates}")
+        self.logger.info("end: fetch_document_lists")
+        # 取得順に依存しないよう、日付の指定順に並べて返す
+        return [results[target_date] for target_date in target_dates if target_date in results], pending_dates
+
+    def save_all_document_list(self, days: int = 3, doc_info_type=2, max_workers: int = config.EDINET_MAX_WORKERS) -> list[str]:
 
         # 今日の日付
         end_date = datetime.now()
-        current_unix_time = int(time.time())
-        generated_uuid = uuid.uuid4().hex
-
-        hdf5_key = f'document_list_{current_unix_time}_{generated_uuid}'
 
         self.logger.info("start: get_doc_list")
 
-        self.logger.info(f"hdf5 key: {hdf5_key}")
-        document_list = []
-        for x in range(days):
-            target_date = (end_date - timedelta(days=x)).strftime('%Y-%m-%d')
-            params = {
-                'date': target_date,
-                'type': doc_info_type
-            }
-            response = self.get_data_from_edinet(config.EDINET_DOC_INFO_URL_PATH, params)
-            if response.status_code == 200:
-
-                document_list.append(response.json())
-                if (x) % 10 == 0:
-                    self.logger.info(f"get doc info executed days: {x + 1}, current target_date:{target_date}")
-            else:
-                self.logger.error(f"get doc info failed, current target_date:{target_date}")
+        target_dates = [(end_date - timedelta(days=x)).strftime('%Y-%m-%d') for x in range(days)]
+        document_list, failed_dates = self.fetch_document_lists(target_dates, doc_info_type, max_workers=max_workers)
 
         self.logger.info("end: get_doc_list")
         
-        metadata = MetaData()
-
-        document_list_table = Table('document_list_table', metadata,
-                                    Column('docID', String, primary_key=True),
-                                    Column('edinetCode', String),
-                                    Column('secCode', String),
-                                    Column('JCN', String),
-                                    Column('filerName', String),
-                                    Column('fundCode', String),
-                                    Column('ordinanceCode', String),
-                                    Column('formCode', String),
-                                    Column('docTypeCode', String),
-                                    Column('periodStart', String),
-                                    Column('periodEnd', String),
-                                    Column('submitDateTime', String),
-                                    Column('docDescription', String),
-                                    Column('issuerEdinetCode', String),
-                                    Column('subjectEdinetCode', String),
-                                    Column('subsidiaryEdinetCode', String),
-                                    Column('currentReportReason', String),
-                                    Column('parentDocID', String),
-                                    Column('opeDateTime', String),
-                                    Column('withdrawalStatus', String),
-                                    Column('docInfoEditStatus', String),
-                                    Column('disclosureStatus', String),
-                                    Column('xbrlFlag', String),
-                                    Column('pdfFlag', String),
-                                    Column('attachDocFlag', String),
-                                    Column('englishDocFlag', String),
-                                    Column('csvFlag', String),
-                                    Column('legalStatus', String),
-                                    )
-
-
-        engine = create_engine(f'sqlite:///{config.EDINET_DB}')
-        metadata.drop_all(engine)
-        metadata.create_all(engine)
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
+        document_list_table = DocumentListTable.__table__
+        document_list_table.drop(engine, checkfirst=True)
+        document_list_table.create(engine)
+
+        document_list_df = self.to_document_list_df(document_list)
+
+        self.logger.info("start: save to db")
+        document_list_df.to_sql('document_list_table', con=engine, if_exists='append', index=False)
+        self.logger.info("end: save to db")
+        # HDF5 は DB の後に書き込み、失敗しても DB のテーブルには影響させない
+        self.save_document_list_to_hdf5(document_list_df)
+        return failed_dates
 
+    def save_document_list_to_hdf5(self, document_list_df: pd.DataFrame) -> None:
+        # 1つのテーブルに追記し、docIDが重複する既存行は置き換える
+        self.logger.info("start: save to hdf5")
+        self.logger.info(f"hdf5 key: {config.EDINET_HDF5_KEY}")
+        if len(document_list_df) == 0:
+            self.logger.info("end: save to hdf5")
+            return
+        column_names = [column.name for column in DocumentListTable.__table__.columns]
+        hdf5_df = document_list_df.reindex(columns=column_names).astype(object)
+        min_itemsize = {column_name: config.EDINET_HDF5_MIN_ITEMSIZE.get(column_name, 64) for column_name in column_names}
+
+        with pd.HDFStore(config.EDINET_HDF5, mode='a') as store:
+            coordinates = []
+            if config.EDINET_HDF5_KEY in store:
+                existing_doc_ids = store.select_column(config.EDINET_HDF5_KEY, 'docID')
+                coordinates = existing_doc_ids.index[existing_doc_ids.isin(hdf5_df['docID'])]
+            # 追記に失敗しても既存の行が消えないよう、追記が成功してから置き換え前の行を削除する
+            try:
+                store.append(config.EDINET_HDF5_KEY, hdf5_df, format='table', data_columns=config.EDINET_HDF5_DATA_COLUMNS, min_itemsize=min_itemsize)
+            except ValueError as e:
+                # 作成済みのテーブルの列幅を超える文字列がある場合。EDINET_HDF5_MIN_ITEMSIZE を見直して作り直す
+                self.logger.error(f"save to hdf5 failed, rows: {len(hdf5_df)}, error: {e}")
+                return
+            if len(coordinates) > 0:
+                self.logger.info(f"replace rows: {len(coordinates)}")
+                store.remove(config.EDINET_HDF5_KEY, where=coordinates)
+        self.logger.info("end: save to hdf5")
+
+    def iter_document_list_from_hdf5(self, target_date_start: str, target_date_end: str, edinet_code: str = None, doc_types: list[str] = None, chunksize: int = config.EDINET_HDF5_CHUNK_SIZE):
+        # data_columns に対する where 条件で絞り込み、chunksize 行ずつ返す
+        conditions = [f"submitDateTime >= {target_date_start!r}", f"submitDateTime <= {target_date_end + ' 23:59'!r}"]
+        if edinet_code:
+            conditions.append(f"edinetCode == {edinet_code!r}")
+        if doc_types:
+            conditions.append(f"docTypeCode in {list(doc_types)!r}")
+        where = " & ".join(conditions)
+        self.logger.info(f"hdf5 where: {where}")
+
+        with pd.HDFStore(config.EDINET_HDF5, mode='r') as store:
+            for chunk_df in store.select(config.EDINET_HDF5_KEY, where=where, chunksize=chunksize):
+                yield chunk_df
+
+    def get_document_list_from_hdf5(self, target_date_start: str, target_date_end: str, edinet_code: str = None, doc_types: list[str] = None) -> pd.DataFrame:
+        chunk_dfs = list(self.iter_document_list_from_hdf5(target_date_start, target_date_end, edinet_code, doc_types))
+        if not chunk_dfs:
+            return pd.DataFrame(columns=[column.name for column in DocumentListTable.__table__.columns])
+        return pd.concat(chunk_dfs)
+
+    def to_document_list_df(self, document_list: list[dict]) -> pd.DataFrame:
         self.logger.info("start: modify df")
         document_list_df = pd.json_normalize(document_list, record_path=['results'])
+        if len(document_list_df) == 0:
+            self.logger.info("end: modify df")
+            return document_list_df
         document_list_df.drop(columns=['seqNumber'], inplace=True)
         document_list_df.drop_duplicates(subset=['docID'], inplace=True)
+        document_list_df['submitDate'] = document_list_df['submitDateTime'].str[:10]
         self.logger.info("end: modify df")
-        self.logger.info("start: save to hdf5")
-        document_list_df.to_hdf('data/edinet.h5', key=hdf5_key, format='table', mode='w')
-        self.logger.info("end: save to hdf5")
+        return document_list_df
 
-        self.logger.info("start: save to db")
-        document_list_df.to_sql('document_list_table', con=engine, if_exists='append', index=False)
-        self.logger.info("end: save to db")
+    def sync_document_list(self, recheck_days: int = config.EDINET_SYNC_RECHECK_DAYS, initial_days: int = 3, doc_info_type=2, max_workers: int = config.EDINET_MAX_WORKERS) -> list[str]:
+        self.logger.info("start: sync_document_list")
 
-
-    def download_document(self, doc_id: str, edinet_code: str, download_type: int = 1) -> tuple:
+        database_url = f'sqlite:///{config.EDINET_DB}'
+        state_manager = SqlUtils(database_url, SyncStateTable)
+        states = state_manager.get(syncName='document_list')
+        state = states[0] if states else None
+
+        # 前回の同期日から訂正・取下げの確認期間分さかのぼって取得する
+        today = datetime.now().date()
+        if state:
+            last_synced_date = datetime.strptime(state.lastSyncedDate, '%Y-%m-%d').date()
+            start_date = min(last_synced_date - timedelta(days=recheck_days), today)
+        else:
+            start_date = today - timedelta(days=initial_days - 1)
+        target_dates = [(today - timedelta(days=x)).strftime('%Y-%m-%d') for x in range((today - start_date).days + 1)]
+        self.logger.info(f"sync target dates: {target_dates[-1]} - {target_dates[0]}")
+
+        document_list, failed_dates = self.fetch_document_lists(target_dates, doc_info_type, max_workers=max_workers)
+        document_list_df = self.to_document_list_df(document_list)
+
+        if len(document_list_df) > 0:
+            self.logger.info("start: upsert to db")
+            manager = SqlUtils(database_url, DocumentListTable)
+            column_names = [column.name for column in DocumentListTable.__table__.columns]
+            manager.upsert(df_to_records(document_list_df, column_names))
+            self.logger.info("end: upsert to db")
+            self.save_document_list_to_hdf5(document_list_df)
+
+        # 取得に失敗した日付の前日までを同期済みとする
+        if failed_dates:
+            synced_date = (datetime.strptime(min(failed_dates), '%Y-%m-%d').date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        else:
+            synced_date = target_dates[0]
+        last_ope_date_time = state.lastOpeDateTime if state else None
+        if 'opeDateTime' in document_list_df.columns and document_list_df['opeDateTime'].notna().any():
+            last_ope_date_time = max(filter(None, [last_ope_date_time, document_list_df['opeDateTime'].max()]))
+        state_manager.upsert([{
+            'syncName': 'document_list',
+            'lastSyncedDate': max(filter(None, [state.lastSyncedDate if state else None, synced_date])),
+            'lastOpeDateTime': last_ope_date_time,
+            'updatedAt': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }])
+        self.logger.info(f"synced date: {synced_date}, docs: {len(document_list_df)}, failed dates: {failed_dates}")
+
+        self.logger.info("end: sync_document_list")
+        return failed_dates
+
+
+    def download_document(self, doc_id: str, edinet_code: str, download_type: int = 1, in_memory: bool = False) -> tuple:
         params = {
             'type': download_type
         }
-        self.logger.info("start: download_document")
-        self.logger.info(f"doc_id: {doc_id}")
+        self.logger.info_sampled(f"start: download_document, doc_id: {doc_id}", key="start: download_document")
+
+        # 提出済みの書類は docID ごとに不変なので、キャッシュがあればそれを使う
+        cached_path = self.document_cache.get(doc_id, download_type) if self.document_cache else None
+        if cached_path:
+            self.logger.info_sampled(f"cache hit: {cached_path}", key="cache hit")
+            self.metrics.increment("cache_hits_total")
+            if in_memory:
+                file_path = open(cached_path, 'rb')
+            else:
+                file_path = os.path.join(config.DOWNLOAD_PATH, f"{edinet_code}_{doc_id}{config.DOWNLOAD_TYPES[download_type]}")
+                copyfile(cached_path, file_path)
+            return (200, file_path, doc_id, edinet_code)
+
         url_path = config.EDINET_DOC_URL_PATH.format(doc_id=doc_id)
-        response = self.get_data_from_edinet(url_path=url_path, params=params)
+        response = self.get_data_from_edinet(url_path=url_path, params=params, stream=True)
 
-        self.logger.info(f"status_code: {response.status_code}")
+        self.logger.info_sampled(f"doc_id: {doc_id}, status_code: {response.status_code}", key=f"status_code: {response.status_code}")
         file_path = None
         status_code = response.status_code
-        if status_code == 200:
-            file_path = os.path.join(config.DOWNLOAD_PATH, f"{edinet_code}_{doc_id}{config.DOWNLOAD_TYPES[download_type]}")
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    f.write(chunk)
+        with response:
+            if status_code == 200 and in_memory:
+                # 一定サイズまではメモリ上に保持し、超えた分だけ一時ファイルに書き出す
+                # この場合は file_path の代わりにバッファを返す
+                file_path = tempfile.SpooledTemporaryFile(max_size=config.DOWNLOAD_SPOOL_MAX_SIZE)
+                for chunk in response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                    file_path.write(chunk)
+                file_path.seek(0)
+            elif status_code == 200:
+                file_path = os.path.join(config.DOWNLOAD_PATH, f"{edinet_code}_{doc_id}{config.DOWNLOAD_TYPES[download_type]}")
+                with open(file_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+
+        if status_code == 200 and self.document_cache:
+            self.document_cache.put(doc_id, download_type, file_path)
+            if in_memory:
+                file_path.seek(0)
         
-        self.logger.info("end: download_document")
         return (status_code, file_path, doc_id, edinet_code) 
 
     def get_doc_id_list(self, edinet_code: str, target_date_start: str, target_date_end: str, doc_types: list[str] = ["120"]) -> dict:
@@ -141,7 +342,7 @@ class EdinetUtils:
         manager = SqlUtils(database_url, DocumentListTable)
 
         select_conditions = {
-            "submitDateTime": {"type": "date", "filter_type": "between", "start": target_date_start, "end": target_date_end},
+            "submitDate": {"type": "string", "filter_type": "between", "start": target_date_start, "end": target_date_end},
             "docTypeCode": {"type": "string", "filter_type": "in", "values": doc_types}
         }
         if edinet_code != "all":
@@ -151,203 +352,98 @@ class EdinetUtils:
 
         self.logger.info("end: get_doc_id_list")
 
-        print([f"{document_list_table.docID},{document_list_table.edinetCode},{document_list_table.submitDateTime}" for document_list_table in query_response])
+        self.logger.debug([f"{document_list_table.docID},{document_list_table.edinetCode},{document_list_table.submitDateTime}" for document_list_table in query_response])
 
         return query_response
 
+    def plan_documents(self, edinet_codes: list[str], target_date_start: str, target_date_end: str, doc_types: list[str] = ["120", "140", "160"]) -> dict:
+        # 期間内の対象書類を1回のクエリで取得し、書類のある会社だけを edinet_codes の順に返す
+        self.logger.info("start: plan_documents")
+        query_response = self.get_doc_id_list("all", target_date_start, target_date_end, doc_types)
+
+        target_codes = set(edinet_codes)
+        documents_by_code = {}
+        for document_list in query_response:
+            if document_list.edinetCode in target_codes:
+                documents_by_code.setdefault(document_list.edinetCode, []).append(document_list)
+        planned_documents = {edinet_code: documents_by_code[edinet_code] for edinet_code in edinet_codes if edinet_code in documents_by_code}
+
+        self.logger.info(f"companies: {len(target_codes)}, companies with documents: {len(planned_documents)}, documents: {sum(len(documents) for documents in planned_documents.values())}")
+        self.logger.info("end: plan_documents")
+        return planned_documents
+
     def xbrl_parser(self, xbrl_file_path: str):
         pass
 
     def save_tag_to_db(self, file_path: str):
         self.logger.info("start: save_tag_to_db")
-        column_name_mapping = {
-            '様式ツリー-標準ラベル（日本語）': 'standardLabelTree',
-            '詳細ツリー-標準ラベル（日本語）': 'detailedLabelTree',
-            '冗長ラベル（日本語）': 'verboseLabelJp',
-            '標準ラベル（英語）': 'standardLabelEn',
-            '冗長ラベル（英語）': 'verboseLabelEn',
-            '用途区分、財務諸表区分及び業種区分のラベル（日本語）': 'classificationLabelJp',
-            '用途区分、財務諸表区分及び業種区分のラベル（英語）': 'classificationLabelEn',
-            '名前空間プレフィックス': 'namespacePrefix',
-            '要素名': 'elementName',
-            'elementId': 'elementId',
-            'type': 'type',
-            'substitutionGroup': 'substitutionGroup',
-            'periodType': 'periodType',
-            'balance': 'balance',
-            'abstract': 'abstract',
-            'depth': 'depth',
-            'documentationラベル（日本語）': 'documentationLabelJp',
-            'documentationラベル（英語）': 'documentationLabelEn',
-            '参照リンク': 'referenceLink',
-            'Document Information': 'documentInformation',
-            'parentElementName': 'parentElementName',
-            'parentStandardLabelTree': 'parentStandardLabelTree',
-            'parentDetailedLabelTree': 'parentDetailedLabelTree',
-            'submitDateTime': 'submitDateTime'
-        }
-        tag_df = pd.read_excel(file_path, sheet_name="9", header=1)
-        tag_df.dropna(how='all', subset=['要素名'], inplace=True)
-        tag_df.dropna(how='all', inplace=True)
-        tag_df.fillna(method='ffill', inplace=True)
-        print(tag_df.columns)
-    
-        tag_df.rename(columns=column_name_mapping, inplace=True)
-        tag_df['parentElementName'] = np.where(tag_df['depth'] == 0, tag_df['elementName'], np.nan)
-        tag_df['parentStandardLabelTree'] = np.where(tag_df['depth'] == 0, tag_df['standardLabelTree'], np.nan)
-        tag_df['parentDetailedLabelTree'] = np.where(tag_df['depth'] == 0, tag_df['detailedLabelTree'], np.nan)
-        tag_df['parentElementName'].fillna(method='ffill', inplace=True)
-        tag_df['parentStandardLabelTree'].fillna(method='ffill', inplace=True)
-        tag_df['parentDetailedLabelTree'].fillna(method='ffill', inplace=True)
-        tag_df['elementId'] = tag_df['namespacePrefix'] + ':' + tag_df['elementName']
+        tag_df = get_taxonomy_loader().load_tag_table(file_path)
         tag_df['submitDateTime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        tag_df['classificationLabelJp'] = tag_df['classificationLabelJp'].str.replace('_x000D_', ' ')
-        tag_df['classificationLabelJp'] = tag_df['classificationLabelJp'].replace(r'\s+|\\n', ' ', regex=True)
-        tag_df['classificationLabelEn'] = tag_df['classificationLabelEn'].str.replace('_x000D_', ' ')
-        tag_df['classificationLabelEn'] = tag_df['classificationLabelEn'].replace(r'\s+|\\n', ' ', regex=True)
-        tag_df['classificationLabelJp'] = tag_df['classificationLabelJp'].str.replace('_x000D_', ' ')
-        tag_df['classificationLabelJp'] = tag_df['classificationLabelJp'].replace(r'\s+|\\n', ' ', regex=True)
-        tag_df['referenceLink'] = tag_df['referenceLink'].str.replace('_x000D_', ' ')
-        tag_df['referenceLink'] = tag_df['referenceLink'].replace(r'\s+|\\n', ' ', regex=True)
 
-
-        engine = create_engine(f'sqlite:///{config.EDINET_DB}')
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
         tag_df.to_sql('tag_table', con=engine, if_exists='replace', index=False)
+        LabelSearchIndex(f'sqlite:///{config.EDINET_DB}').rebuild('tag')
 
         self.logger.info("end: save_tag_to_db")
     
     def save_account_tag_to_db(self, file_path: str):
         self.logger.info("start: save_account_tag_to_db")
-
-        column_name_mapping = {
-            '科目分類': 'accountClassification',
-            'industry': 'industry',
-            '標準ラベル（日本語）': 'standardLabel',
-            '冗長ラベル（日本語）': 'verboseLabel',
-            '標準ラベル（英語）': 'standardLabelEn',
-            '冗長ラベル（英語）': 'verboseLabelEn',
-            '用途区分、財務諸表区分及び業種区分のラベル（日本語）': 'classificationLabelJp',
-            '用途区分、財務諸表区分及び業種区分のラベル（英語）': 'classificationLabelEn',
-            '名前空間プレフィックス': 'namespacePrefix',
-            '要素名': 'elementName',
-            'type': 'type',
-            'substitutionGroup': 'substitutionGroup',
-            'periodType': 'periodType',
-            'balance': 'balance',
-            'abstract': 'abstract',
-            'depth': 'depth',
-            '参照リンク': 'referenceLink',
-            'parentElementName': 'parentElementName',
-            'parentStandardLabel': 'parentStandardLabel',
-            'submitDateTime': 'submitDateTime'
-        }
-        
-        account_type_list = [
-            "貸借対照表　科目一覧",
-            "損益計算書　科目一覧",
-            "包括利益計算書　科目一覧",
-            "株主資本等変動計算書　科目一覧",
-            "キャッシュ・フロー計算書　科目一覧",
-            "社員資本等変動計算書　科目一覧",
-            "投資主資本等変動計算書　科目一覧",
-            "純資産変動計算書　科目一覧",
-            "純資産変動計算書　科目一覧",
-            "損益及び剰余金計算書　科目一覧",
-        ]
-
-        account_xlsx = pd.ExcelFile(file_path, engine='openpyxl')
-
-        skip_sheet_list = ['目次', '勘定科目リストについて']
-
-        account_df_list = []
-        for sheet_name in account_xlsx.sheet_names:
-            if sheet_name in skip_sheet_list:
-                continue
-            
-            _account_df = pd.read_excel(file_path, sheet_name=sheet_name, header=1)
-            _account_df = _account_df[~_account_df['科目分類'].isin(account_type_list + ['科目分類'] + [np.nan])]
-            _account_df = _account_df[~_account_df['科目分類'].isin(account_type_list + ['科目分類'] + [np.nan])]
-            _account_df['industry'] = sheet_name
-
-            account_df_list.append(_account_df)
-
-        account_df = pd.concat(account_df_list)
-        account_df.rename(columns=column_name_mapping, inplace=True)
-        account_df['parentElementName'] = np.where(account_df['depth'] == 0, account_df['elementName'], np.nan)
-        account_df['parentStandardLabel'] = np.where(account_df['depth'] == 0, account_df['standardLabel'], np.nan)
-
-        account_df.rename(columns=column_name_mapping, inplace=True)
-        account_df['parentElementName'] = np.where(account_df['depth'] == 0, account_df['elementName'], np.nan)
-        account_df['parentStandardLabel'] = np.where(account_df['depth'] == 0, account_df['standardLabel'], np.nan)
-        account_df['parentElementName'].fillna(method='ffill', inplace=True)
-        account_df['parentStandardLabel'].fillna(method='ffill', inplace=True)
-        account_df['elementId'] = account_df['namespacePrefix'] + ':' + account_df['elementName']
+        account_df = get_taxonomy_loader().load_account_tag_table(file_path)
         account_df['submitDateTime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        account_df['classificationLabelJp'] = account_df['classificationLabelJp'].str.replace('_x000D_', ' ')
-        account_df['classificationLabelJp'] = account_df['classificationLabelJp'].replace(r'\s+|\\n', ' ', regex=True)
-        account_df['classificationLabelEn'] = account_df['classificationLabelEn'].str.replace('_x000D_', ' ')
-        account_df['classificationLabelEn'] = account_df['classificationLabelEn'].replace(r'\s+|\\n', ' ', regex=True)
-        account_df['classificationLabelJp'] = account_df['classificationLabelJp'].str.replace('_x000D_', ' ')
-        account_df['classificationLabelJp'] = account_df['classificationLabelJp'].replace(r'\s+|\\n', ' ', regex=True)
-        account_df['referenceLink'] = account_df['referenceLink'].str.replace('_x000D_', ' ')
-        account_df['referenceLink'] = account_df['referenceLink'].replace(r'\s+|\\n', ' ', regex=True)
-
-        engine = create_engine(f'sqlite:///{config.EDINET_DB}')
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
         account_df.to_sql('account_tag_table', con=engine, if_exists='replace', index=False)
+        LabelSearchIndex(f'sqlite:///{config.EDINET_DB}').rebuild('account_tag')
 
         self.logger.info("end: save_account_tag_to_db")
+
+    def get_element_index(self) -> dict:
+        # elementId → ラベル・親要素・深さ。tag_table / account_tag_table から作り、プロセス内で使い回す
+        return get_taxonomy_loader().get_element_index(get_engine(f'sqlite:///{config.EDINET_DB}'))
+
+    def get_element_labels(self, element_id: str) -> dict:
+        # 要素のラベル・親要素・深さを返す
+        return self.get_element_index().get(element_id)
+
+    def search_elements(self, query: str, limit: int = 20, source: str = None) -> pd.DataFrame:
+        # ラベルの部分文字列から要素IDを探す。空白区切りの語句はすべて含むものを返す
+        return LabelSearchIndex(f'sqlite:///{config.EDINET_DB}').search(query, limit=limit, source=source)
     
-    def get_securities_report_by_edinet_code(self, edinet_code: str, target_date_start: str, target_date_end: str, doc_types: list[str] = ["120", "140", "160"], org_file_prefix_list: list[str] = ["jpcrp030000", "jpcrp040300", "jpcrp050000"]) -> pd.DataFrame:
+    def get_securities_report_by_edinet_code(self, edinet_code: str, target_date_start: str, target_date_end: str, doc_types: list[str] = ["120", "140", "160"], org_file_prefix_list: list[str] = ["jpcrp030000", "jpcrp040300", "jpcrp050000"], download_workers: int = config.DOWNLOAD_WORKERS, parse_workers: int = config.PARSE_WORKERS, persist_raw: bool = False, documents: list[DocumentListTable] = None, parse_processes: int = config.PARSE_PROCESSES, on_stage=None) -> pd.DataFrame:
         self.logger.info("start: get_securities_report_by_edinet_code")
-        response = self.get_doc_id_list(edinet_code, target_date_start, target_date_end, doc_types)
-
-        target_dfs = []
-        with tempfile.TemporaryDirectory() as temp_dir:
-            print(temp_dir)
-            for document_list in response:
-                self.logger.info(f"doc_id: {document_list.docID}")
-                self.logger.info(f"edinet_code: {document_list.edinetCode}")
-                self.logger.info(f"submit_date_time: {document_list.submitDateTime}")
-                self.logger.info(f"doc_type: {document_list.docTypeCode}")
-                self.logger.info(f"doc_description: {document_list.filerName}")
-                doc_id = document_list.docID
-                edinet_code = document_list.edinetCode
-                doc_type_code = document_list.docTypeCode
-                status_code, file_path, doc_id, edinet_code = self.download_document(doc_id=doc_id, edinet_code=edinet_code, download_type=5)
-                if status_code == 200:
-                    self.logger.info(f"file_path: {file_path}")
-                    with ZipFile(file_path, 'r') as zip_ref:
-                        for file_info in zip_ref.infolist():
-                            print(file_info.filename)
-                            # プレフィックスが一致するファイルを探す
-                            file_path = file_info.filename
-                            _, filename = os.path.split(file_info.filename)
-                            is_finished = False
-                            for org_file_prefix in org_file_prefix_list:
-                                if filename.startswith(org_file_prefix):
-                                    period = "full"
-                                    # # ファイルの拡張子を保持
-                                    if org_file_prefix == "jpcrp040300":
-                                        splited_value = filename.split("-")
-                                        period = splited_value[1]
-                                    if org_file_prefix == "jpcrp050000":
-                                        period = "half"
-
-                                    file_dates = re.findall(r'\d{4}-\d{2}-\d{2}', filename)
-                                    target_df = pd.read_csv(zip_ref.open(file_info), encoding='utf-16-le', sep='\t')
-                                    target_df['fiscalYear'] = file_dates[0]
-                                    target_df['submitDateTime'] = file_dates[1]
-                                    target_df['docID'] = doc_id
-                                    target_df['edinetCode'] = edinet_code
-                                    target_df['docTypeCode'] = doc_type_code
-                                    target_df['period'] = period
-                                    target_df['filePrefix'] = org_file_prefix
-                                    target_dfs.append(target_df)
-                                    is_finished = True
-                                    break
-                            if is_finished:
-                                break
+        # plan_documents で取得済みの書類が渡された場合はDBを検索しない
+        response = documents if documents is not None else self.get_doc_id_list(edinet_code, target_date_start, target_date_end, doc_types)
+
+        # ダウンロード → 解析 の順にステージを分けて並行実行する
+        # parse_processes を指定した場合、CSVの解析はプロセスプールで行う
+        # on_stage を指定した場合、書類ごとに各ステージの完了 (docID, ステージ, エラー) を通知する
+        parse_executor = self.get_parse_executor(parse_processes) if parse_processes else None
+        # 解析スレッドはプロセスの結果を待つので、全プロセスが埋まるようプロセス数以上のスレッドを用意する
+        if parse_executor:
+            parse_workers = max(parse_workers, parse_processes)
+        notify_stage = on_stage or (lambda doc_id, stage, error=None: None)
+
+        def download(document_list):
+            downloaded = self.download_csv_document(document_list, in_memory=not persist_raw)
+            if on_stage and downloaded[1] != 200:
+                raise RuntimeError(f"download failed, status_code: {downloaded[1]}")
+            notify_stage(document_list.docID, "downloaded")
+            return downloaded
+
+        def parse(downloaded):
+            parsed_dfs = self.parse_csv_document(*downloaded, org_file_prefix_list=org_file_prefix_list, parse_executor=parse_executor)
+            notify_stage(downloaded[0].docID, "parsed")
+            return parsed_dfs
+
+        stages = [
+            (download, download_workers),
+            (parse, parse_workers),
+        ]
+        parsed_list, errors = run_staged_pipeline(response, stages, queue_size=config.PIPELINE_QUEUE_SIZE)
+        for index, e in errors:
+            self.logger.error(f"doc_id: {response[index].docID}, error: {e}")
+            notify_stage(response[index].docID, "failed", str(e))
+        target_dfs = [target_df for parsed_dfs in parsed_list for target_df in parsed_dfs]
         
         column_name_mapping = {
             'docID': 'docID',
@@ -369,33 +465,171 @@ class EdinetUtils:
         }
 
 
-        combined_df = pd.concat(target_dfs, ignore_index=True)
-        combined_df.rename(columns=column_name_mapping, inplace=True)
-        combined_df = combined_df.drop_duplicates()
-        combined_df = combined_df[column_name_mapping.values()]
+        if not target_dfs:
+            self.logger.info("end: get_securities_report_by_edinet_code")
+            return pd.DataFrame(columns=list(column_name_mapping.values()) + ['numericValue', 'normalizedUnit'])
+
+        with self.metrics.timer("dedupe"):
+            combined_df = pd.concat(target_dfs, ignore_index=True)
+            combined_df.rename(columns=column_name_mapping, inplace=True)
+            combined_df = combined_df.drop_duplicates()
+            combined_df = combined_df[column_name_mapping.values()]
+            # CSVに項目名が無い行は、タクソノミの標準ラベルで補う
+            missing_item_name = combined_df['itemName'].isna()
+            if missing_item_name.any():
+                element_index = self.get_element_index()
+                combined_df.loc[missing_item_name, 'itemName'] = combined_df.loc[missing_item_name, 'elementId'].map(lambda element_id: (element_index.get(element_id) or {}).get('labelJp'))
+        with self.metrics.timer("numeric"):
+            combined_df = add_numeric_values(combined_df)
         self.logger.info("end: get_securities_report_by_edinet_code")
         return combined_df
 
 
+    def download_csv_document(self, document_list: DocumentListTable, in_memory: bool = True) -> tuple:
+        self.logger.info_sampled(
+            f"doc_id: {document_list.docID}, edinet_code: {document_list.edinetCode}, submit_date_time: {document_list.submitDateTime}, "
+            f"doc_type: {document_list.docTypeCode}, doc_description: {document_list.filerName}",
+            key="download_csv_document"
+        )
+        with self.metrics.timer("download", doc_type=document_list.docTypeCode):
+            status_code, file_path, doc_id, edinet_code = self.download_document(doc_id=document_list.docID, edinet_code=document_list.edinetCode, download_type=5, in_memory=in_memory)
+        if status_code == 200:
+            file_size = file_path.seek(0, os.SEEK_END) if hasattr(file_path, 'read') else os.path.getsize(file_path)
+            if hasattr(file_path, 'read'):
+                file_path.seek(0)
+            self.metrics.increment("download_bytes_total", file_size, doc_type=document_list.docTypeCode)
+        return (document_list, status_code, file_path)
+
+    def parse_csv_document(self, document_list: DocumentListTable, status_code: int, file_path: str, org_file_prefix_list: list[str], parse_executor: ProcessPoolExecutor = None) -> list[pd.DataFrame]:
+        target_dfs = []
+        if status_code != 200:
+            self.logger.error(f"download failed, doc_id: {document_list.docID}, status_code: {status_code}")
+            return target_dfs
+
+        doc_id = document_list.docID
+        edinet_code = document_list.edinetCode
+        doc_type_code = document_list.docTypeCode
+        self.logger.debug(f"file_path: {file_path}")
+        # file_path にはパスとバッファのどちらも渡せる
+        with file_path if hasattr(file_path, 'read') else nullcontext(), ZipFile(file_path, 'r') as zip_ref:
+            for file_info in zip_ref.infolist():
+                self.logger.debug(file_info.filename)
+                # プレフィックスが一致するファイルを探す
+                _, filename = os.path.split(file_info.filename)
+                is_finished = False
+                for org_file_prefix in org_file_prefix_list:
+                    if filename.startswith(org_file_prefix):
+                        period = "full"
+                        # # ファイルの拡張子を保持
+                        if org_file_prefix == "jpcrp040300":
+                            splited_value = filename.split("-")
+                            period = splited_value[1]
+                        if org_file_prefix == "jpcrp050000":
+                            period = "half"
+
+                        file_dates = re.findall(r'\d{4}-\d{2}-\d{2}', filename)
+                        with self.metrics.timer("unzip", doc_type=doc_type_code):
+                            data = zip_ref.read(file_info)
+                        with self.metrics.timer("parse", doc_type=doc_type_code):
+                            if parse_executor:
+                                target_df = read_parsed_member(parse_executor.submit(parse_tsv_member, data).result())
+                            else:
+                                target_df = pd.read_csv(BytesIO(data), encoding='utf-16-le', sep='\t')
+                        self.metrics.increment("parsed_rows_total", len(target_df), doc_type=doc_type_code)
+                        target_df['fiscalYear'] = file_dates[0]
+                        target_df['submitDateTime'] = file_dates[1]
+                        target_df['docID'] = doc_id
+                        target_df['edinetCode'] = edinet_code
+                        target_df['docTypeCode'] = doc_type_code
+                        target_df['period'] = period
+                        target_df['filePrefix'] = org_file_prefix
+                        target_dfs.append(target_df)
+                        is_finished = True
+                        break
+                if is_finished:
+                    break
+        return target_dfs
+
     def save_securities_report_to_db(self, combined_df: pd.DataFrame) -> None:
+        if config.NORMALIZED_SCHEMA:
+            self.save_securities_report_to_normalized_db(combined_df)
+            return
         self.logger.info("start: save_securities_report_to_db")
-        engine = create_engine(f'sqlite:///{config.EDINET_DB}')
-        SecuritiesReportTable.metadata.create_all(engine)
-        existing_df = pd.read_sql_table('securities_report_table', con=engine)
-        combined_df = pd.concat([existing_df, combined_df], ignore_index=True)
-        combined_df = combined_df.drop_duplicates(subset=['docID', 'edinetCode', 'elementId', 'contextId'], keep='first')
-        final_df = combined_df[~combined_df.index.isin(existing_df.index)]
-        print(final_df.head(10))
-
-        final_df.to_sql('securities_report_table', con=engine, if_exists='append', index=False)
+        database_url = f'sqlite:///{config.EDINET_DB}'
+        manager = SqlUtils(database_url, SecuritiesReportTable)
+        # 重複の判定は主キー (docID, edinetCode, elementId, contextId) でDB側に任せる
+        primary_keys = [column.name for column in SecuritiesReportTable.__table__.primary_key.columns]
+        with self.metrics.timer("dedupe"):
+            final_df = combined_df.drop_duplicates(subset=primary_keys, keep='first')
+        column_names = [column.name for column in SecuritiesReportTable.__table__.columns]
+        with self.metrics.timer("db_write", sink="sqlite"):
+            inserted_count = manager.insert_or_ignore(df_to_records(final_df, column_names), chunk_size=config.DB_WRITE_CHUNK_SIZE)
+        self.metrics.increment("db_inserted_rows_total", inserted_count, sink="sqlite")
+        self.logger.info(f"rows: {len(final_df)}, inserted: {inserted_count}")
+        self.update_latest_facts(final_df['docID'].dropna().unique().tolist())
 
         self.logger.info("end: save_securities_report_to_db")
 
-    def get_by_element_id(self, element_id: str, fiscal_year: str, edinet_id: str, period: list[str] = ["full", "half", "q1r", "q2r", "q3r"], doc_id: str = None, relative_fiscal_year: str = "当期") -> pd.DataFrame:
+    def save_securities_report_to_normalized_db(self, combined_df: pd.DataFrame) -> None:
+        # 繰り返し出現する文字列をディメンションテーブルに登録し、ファクトテーブルには整数キーで保存する
+        self.logger.info("start: save_securities_report_to_normalized_db")
+        database_url = f'sqlite:///{config.EDINET_DB}'
+        primary_keys = [column.name for column in SecuritiesReportTable.__table__.primary_key.columns]
+        fact_df = combined_df.drop_duplicates(subset=primary_keys, keep='first')
+
+        for model, key_column, value_columns in DIMENSION_TABLES:
+            dimension_df = fact_df[value_columns].astype(object).fillna('').astype(str)
+            unique_df = dimension_df.drop_duplicates()
+            dim_manager = SqlUtils(database_url, model)
+            dim_manager.insert_or_ignore(df_to_records(unique_df))
+            keys_df = lookup_dimension_keys(dim_manager.engine, model, key_column, unique_df)
+            fact_df = pd.concat([fact_df.drop(columns=value_columns).reset_index(drop=True), dimension_df.reset_index(drop=True)], axis=1)
+            fact_df = fact_df.merge(keys_df, on=value_columns, how='left')
+
+        manager = SqlUtils(database_url, SecuritiesReportFactTable)
+        column_names = [column.name for column in SecuritiesReportFactTable.__table__.columns]
+        with self.metrics.timer("db_write", sink="normalized"):
+            inserted_count = manager.insert_or_ignore(df_to_records(fact_df, column_names), chunk_size=config.DB_WRITE_CHUNK_SIZE)
+        self.metrics.increment("db_inserted_rows_total", inserted_count, sink="normalized")
+        self.logger.info(f"rows: {len(fact_df)}, inserted: {inserted_count}")
+        self.update_latest_facts(fact_df['docID'].dropna().unique().tolist())
+
+        self.logger.info("end: save_securities_report_to_normalized_db")
+
+    def update_latest_facts(self, doc_ids: list[str]) -> None:
+        # 保存した書類に関係する分だけ latest_fact_table を更新する
+        self.logger.info(f"start: update_latest_facts, docs: {len(doc_ids)}")
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
+        with self.metrics.timer("latest_facts"):
+            refresh_latest_facts(engine, doc_ids)
+        self.logger.info("end: update_latest_facts")
+
+    def rebuild_latest_facts(self) -> None:
+        # 既存のDBで latest_fact_table を作り直す
+        self.logger.info("start: rebuild_latest_facts")
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
+        source_table = get_securities_report_model().__tablename__
+        with engine.begin() as connection:
+            connection.execute(LatestFactTable.__table__.delete())
+            doc_ids = [row[0] for row in connection.execute(text(f"SELECT DISTINCT docID FROM {source_table}"))]
+        refresh_latest_facts(engine, doc_ids, source_table)
+        self.logger.info(f"end: rebuild_latest_facts, docs: {len(doc_ids)}")
+
+    def migrate_to_normalized_schema(self, chunk_size: int = config.DB_WRITE_CHUNK_SIZE * 20) -> None:
+        # securities_report_table の既存データを正規化スキーマにコピーする
+        self.logger.info("start: migrate_to_normalized_schema")
+        engine = get_engine(f'sqlite:///{config.EDINET_DB}')
+        for chunk_df in pd.read_sql_table('securities_report_table', con=engine, chunksize=chunk_size):
+            self.save_securities_report_to_normalized_db(chunk_df)
+        self.logger.info("end: migrate_to_normalized_schema")
+
+    def get_by_element_id(self, element_id: str, fiscal_year: str, edinet_id: str, period: list[str] = ["full", "half", "q1r", "q2r", "q3r"], doc_id: str = None, relative_fiscal_year: str = "当期", latest: bool = False) -> pd.DataFrame:
+        # latest=True の場合は訂正報告書を反映済みの latest_fact_table から取得する
         self.logger.info("start: get_by_element_id")
 
         database_url = f'sqlite:///{config.EDINET_DB}'
-        manager = SqlUtils(database_url, SecuritiesReportTable)
+        securities_report_model = LatestFactTable if latest else get_securities_report_model()
+        manager = SqlUtils(database_url, securities_report_model)
         select_conditions = {
             "elementId": {"type": "string", "filter_type": "eq", "value": element_id},
             "fiscalYear": {"type": "string", "filter_type": "eq", "value": fiscal_year},
@@ -407,47 +641,170 @@ class EdinetUtils:
             select_conditions["docID"] = {"type": "string", "filter_type": "eq", "value": doc_id}
         
         self.logger.info(select_conditions)
-        query_response = manager.get_with_compound_conditions(**select_conditions)
-        print(len(query_response))
-        
-        column_names = [column.name for column in SecuritiesReportTable.__table__.columns]
-
-        result_dict_list = []
-
-        for securities_report_table in query_response:
-            curr_result_dict = {}
-            for column_name in column_names:
-                curr_result_dict[column_name] = getattr(securities_report_table, column_name)
-            if curr_result_dict:
-                result_dict_list.append(curr_result_dict)
+        result_df = manager.get_dataframe(**select_conditions)
+        self.logger.info(f"rows: {len(result_df)}")
         
-        result_df = pd.DataFrame(result_dict_list)
         self.logger.info(result_df.head(10))
 
         self.logger.info("end: get_by_element_id")
 
         return result_df
+
+    def get_panel(self, element_ids: list[str], edinet_codes: list[str] = None, fiscal_years: list[str] = None, period: list[str] = ["full", "half", "q1r", "q2r", "q3r"], relative_fiscal_year: str = "当期", consolidated_or_individual: str = None, value_column: str = "numericValue", latest: bool = False, label: str = None) -> pd.DataFrame:
+        # 複数の要素・企業・年度を1回のクエリで取得し、(edinetCode, fiscalYear, period) × elementId の表にする
+        # edinet_codes / fiscal_years が None の場合は絞り込まない
+        # label に "labelJp" などを指定した場合は、列名を要素IDからタクソノミのラベルに置き換える
+        # latest=True の場合は訂正報告書を反映済みの latest_fact_table から取得する
+        self.logger.info("start: get_panel")
+
+        database_url = f'sqlite:///{config.EDINET_DB}'
+        manager = SqlUtils(database_url, LatestFactTable if latest else get_securities_report_model())
+        select_conditions = {
+            "elementId": {"type": "string", "filter_type": "in", "values": element_ids},
+            "period": {"type": "string", "filter_type": "in", "values": period},
+            "relativeFiscalYear": {"type": "string", "filter_type": "eq", "value": relative_fiscal_year}
+        }
+        if edinet_codes is not None:
+            select_conditions["edinetCode"] = {"type": "string", "filter_type": "in", "values": edinet_codes}
+        if fiscal_years is not None:
+            select_conditions["fiscalYear"] = {"type": "string", "filter_type": "in", "values": fiscal_years}
+        if consolidated_or_individual is not None:
+            select_conditions["consolidatedOrIndividual"] = {"type": "string", "filter_type": "eq", "value": consolidated_or_individual}
+
+        index_columns = ["edinetCode", "fiscalYear", "period"]
+        columns = index_columns + ["elementId", "contextId", "submitDateTime", value_column]
+        result_df = manager.get_dataframe(columns=columns, **select_conditions)
+
+        # 1つのセルに複数の値がある場合は、最新の提出（訂正報告書）かつセグメントなどのメンバーを含まないコンテキストを優先する
+        result_df["hasMember"] = result_df["contextId"].str.contains("_", regex=False)
+        result_df = result_df.sort_values(["submitDateTime", "hasMember"], ascending=[False, True], kind="stable")
+        result_df = result_df.drop_duplicates(subset=index_columns + ["elementId"], keep="first")
+
+        panel_df = result_df.pivot(index=index_columns, columns="elementId", values=value_column)
+        panel_df = panel_df.reindex(columns=element_ids).sort_index()
+        panel_df.columns.name = None
+        if label:
+            # ラベルが無い要素は要素IDのままにする
+            element_index = self.get_element_index()
+            panel_df.columns = [(element_index.get(element_id) or {}).get(label) or element_id for element_id in panel_df.columns]
+        self.logger.info(f"end: get_panel, rows: {len(panel_df)}")
+        return panel_df
     
-    def save_all_edinet_csv_doc_to_db(self, target_date_start: str, target_date_end: str, batch_size=100):
+    def save_securities_report_to_parquet(self, combined_df: pd.DataFrame) -> None:
+        self.logger.info("start: save_securities_report_to_parquet")
+        with self.metrics.timer("db_write", sink="parquet"):
+            ParquetFactStore(config.PARQUET_PATH).write(combined_df)
+        self.logger.info("end: save_securities_report_to_parquet")
+
+    def save_securities_report(self, combined_df: pd.DataFrame, sink: str = "sqlite") -> None:
+        # sink: "sqlite"、"parquet"、"both" のいずれか
+        if sink not in ("sqlite", "parquet", "both"):
+            raise ValueError(f"Invalid sink: {sink}")
+        if sink in ("sqlite", "both"):
+            self.save_securities_report_to_db(combined_df)
+        if sink in ("parquet", "both"):
+            self.save_securities_report_to_parquet(combined_df)
+
+    @profiled
+    def save_all_edinet_csv_doc_to_db(self, target_date_start: str, target_date_end: str, batch_size=100, doc_types: list[str] = ["120", "140", "160"], sink: str = "sqlite", max_attempts: int = config.INGEST_MAX_ATTEMPTS):
         self.logger.info("start: save_all_edinet_csv_doc_to_db")
 
         edinet_codes = self.get_edinet_codes()
-        combined_df = pd.DataFrame()
-        for index, edinet_code in enumerate(edinet_codes):
-            try:
-                if (index + 1) % batch_size == 0:
-                    self.save_securities_report_to_db(combined_df)
-                    combined_df = pd.DataFrame()
-                res_df = self.get_securities_report_by_edinet_code(edinet_code, target_date_start, target_date_end)
-                combined_df = pd.concat([combined_df, res_df], ignore_index=True)
-                self.logger.info(f"edinet_code: {edinet_code}, count: {len(res_df)}")
-            except Exception as e:
-                self.logger.error(e)
-                continue 
-        if len(combined_df) > 0:
-            self.save_securities_report_to_db(combined_df)
-
+        planned_documents = self.plan_documents(edinet_codes, target_date_start, target_date_end, doc_types)
+        # 保存済みの書類と、試行回数の上限に達した失敗書類を除いて再開する
+        planned_documents = self.register_ingest_jobs(planned_documents, max_attempts)
+        self.logger.info(f"ingest progress: {self.get_ingest_progress()}")
+        self.metrics.start_periodic_dump()
+
+        try:
+            combined_df = pd.DataFrame()
+            batch_doc_ids = []
+            for index, (edinet_code, documents) in enumerate(planned_documents.items()):
+                try:
+                    if (index + 1) % batch_size == 0:
+                        self.save_securities_report(combined_df, sink)
+                        self.update_ingest_state(batch_doc_ids, "stored")
+                        combined_df = pd.DataFrame()
+                        batch_doc_ids = []
+                        self.logger.info(f"ingest progress: {self.get_ingest_progress()}")
+                    parsed_doc_ids = []
+
+                    def on_stage(doc_id, stage, error=None):
+                        self.update_ingest_state(doc_id, stage, error)
+                        if stage == "parsed":
+                            parsed_doc_ids.append(doc_id)
+
+                    # 試行回数は実行ごとに1回、書類を処理し始めた時点で数える
+                    self.update_ingest_state([document_list.docID for document_list in documents], "started")
+                    res_df = self.get_securities_report_by_edinet_code(edinet_code, target_date_start, target_date_end, doc_types, documents=documents, on_stage=on_stage)
+                    with self.metrics.timer("concat"):
+                        combined_df = pd.concat([combined_df, res_df], ignore_index=True)
+                    batch_doc_ids.extend(parsed_doc_ids)
+                    self.logger.info(f"edinet_code: {edinet_code}, count: {len(res_df)}")
+                except Exception as e:
+                    self.logger.error(e)
+                    continue 
+            if len(combined_df) > 0:
+                self.save_securities_report(combined_df, sink)
+            self.update_ingest_state(batch_doc_ids, "stored")
+        finally:
+            # 途中で例外が出ても、解析プロセスとメトリクスの書き出しスレッドを止める
+            self.close()
+            self.metrics.stop_periodic_dump()
+
+        self.logger.info(f"ingest progress: {self.get_ingest_progress()}")
         self.logger.info("end: save_all_edinet_csv_doc_to_db")
+
+    def register_ingest_jobs(self, planned_documents: dict, max_attempts: int = config.INGEST_MAX_ATTEMPTS) -> dict:
+        self.logger.info("start: register_ingest_jobs")
+        manager = self.get_ingest_job_manager()
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        manager.insert_or_ignore([
+            {'docID': document_list.docID, 'edinetCode': edinet_code, 'stage': 'pending', 'attempts': 0, 'lastError': None, 'updatedAt': updated_at}
+            for edinet_code, documents in planned_documents.items() for document_list in documents
+        ])
+
+        # 途中で止まった書類も、試行回数が上限に達していれば再実行しない
+        select_conditions = {
+            "stage": {"type": "string", "filter_type": "in", "values": ["stored", "failed", "started", "downloaded", "parsed"]},
+        }
+        finished_doc_ids = {
+            job.docID for job in manager.get_with_compound_conditions(columns=["docID", "stage", "attempts"], **select_conditions)
+            if job.stage == "stored" or job.attempts >= max_attempts
+        }
+        remaining_documents = {}
+        for edinet_code, documents in planned_documents.items():
+            documents = [document_list for document_list in documents if document_list.docID not in finished_doc_ids]
+            if documents:
+                remaining_documents[edinet_code] = documents
+
+        self.logger.info(f"remaining companies: {len(remaining_documents)}, documents: {sum(len(documents) for documents in remaining_documents.values())}")
+        self.logger.info("end: register_ingest_jobs")
+        return remaining_documents
+
+    def update_ingest_state(self, doc_ids, stage: str, error: str = None):
+        # stage: pending / started / downloaded / parsed / stored / failed
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_ids]
+        if not doc_ids:
+            return
+        manager = self.get_ingest_job_manager()
+        values = {'stage': stage, 'lastError': error, 'updatedAt': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        # 試行回数は処理を始めた時点（started）でのみ数え、同じ実行中の失敗では増やさない
+        if stage == "started":
+            values['attempts'] = IngestJobTable.attempts + 1
+        if stage == "failed":
+            self.logger.error(f"ingest failed, doc_ids: {doc_ids}, error: {error}")
+        manager.update_in("docID", doc_ids, **values)
+
+    def get_ingest_progress(self) -> dict:
+        return self.get_ingest_job_manager().count_by("stage")
+
+    def get_ingest_job_manager(self) -> SqlUtils:
+        database_url = f'sqlite:///{config.EDINET_DB}'
+        if database_url not in self.ingest_job_managers:
+            self.ingest_job_managers[database_url] = SqlUtils(database_url, IngestJobTable)
+        return self.ingest_job_managers[database_url]
     
     def get_edinet_codes(self) -> list[str]:
         
@@ -477,7 +834,7 @@ class EdinetUtils:
         url = "https://disclosure2dl.edinet-fsa.go.jp/searchdocument/codelist/Edinetcode.zip"
 
         # ZIPファイルのダウンロード
-        response = requests.get(url)
+        response = self.http_client.get(url)
         zip_file = ZipFile(BytesIO(response.content))
 
         # CSVファイルの読み込み
@@ -504,7 +861,7 @@ class EdinetUtils:
 
         # SQLiteデータベースへの接続設定
         database_url = f"sqlite:///{config.EDINET_DB}"
-        engine = create_engine(database_url)
+        engine = get_engine(database_url)
 
         # データフレームをデータベースに保存
         df.to_sql('edinetcode_table', con=engine, if_exists='replace', index=False)
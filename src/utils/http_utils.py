@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import config
+
+try:
+    import fcntl
+except ImportError:
+    # Windows ではプロセス間で共有せず、プロセス内だけで制限する
+    fcntl = None
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class AdaptiveTokenBucket:
+    # トークンバケットでリクエストの発行レートを制限する
+    # 429/503 を受けたらレートを下げ、成功が続いたら少しずつ戻す
+    # 状態はファイルに保存し、fcntl のロックで同じAPIキーを使う他のプロセスとも共有する
+    def __init__(self, name: str, requests_per_second: float, min_rate: float, max_rate: float, burst: float,
+                 state_path: str = config.RATE_LIMIT_STATE_PATH):
+        self.name = name
+        self.initial_rate = requests_per_second
+        self.min_rate = min_rate
+        # 初期レートが上限を超える場合はそれを上限にする
+        self.max_rate = max(max_rate, requests_per_second)
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.state = None
+        self.state_file = None
+        if state_path and fcntl:
+            os.makedirs(state_path, exist_ok=True)
+            self.state_file = open(os.path.join(state_path, f"{name}.json"), 'a+')
+
+    def _initial_state(self, now: float) -> dict:
+        return {'rate': self.initial_rate, 'tokens': self.burst, 'updated': now, 'blocked_until': 0.0, 'successes': 0}
+
+    @contextmanager
+    def _locked_state(self):
+        with self.lock:
+            if self.state_file is None:
+                if self.state is None:
+                    self.state = self._initial_state(time.time())
+                yield self.state
+                return
+            fcntl.flock(self.state_file, fcntl.LOCK_EX)
+            try:
+                self.state_file.seek(0)
+                content = self.state_file.read()
+                now = time.time()
+                state = json.loads(content) if content else None
+                # 長く使われていない状態は引き継がない
+                if state is None or now - state['updated'] > config.RATE_LIMIT_STATE_TTL:
+                    state = self._initial_state(now)
+                yield state
+                self.state_file.seek(0)
+                self.state_file.truncate()
+                self.state_file.write(json.dumps(state))
+                self.state_file.flush()
+            finally:
+                fcntl.flock(self.state_file, fcntl.LOCK_UN)
+
+    def acquire(self):
+        # トークンを先に予約し、足りない分だけロックの外で待つ
+        with self._locked_state() as state:
+            now = time.time()
+            state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated']) * state['rate'])
+            state['updated'] = now
+            state['tokens'] -= 1
+            wait_time = max(-state['tokens'] / state['rate'], state['blocked_until'] - now)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def on_response(self, status_code: int, retry_after: float = None):
+        with self._locked_state() as state:
+            now = time.time()
+            if status_code in THROTTLE_STATUS_CODES:
+                state['rate'] = max(self.min_rate, state['rate'] * config.RATE_LIMIT_BACKOFF)
+                state['successes'] = 0
+                # 溜まっているトークンを捨て、Retry-After があればその間は発行しない
+                state['tokens'] = min(state['tokens'], 0)
+                state['blocked_until'] = max(state['blocked_until'], now + (retry_after or 1.0 / state['rate']))
+            elif status_code < 500:
+                state['successes'] += 1
+                if state['successes'] >= config.RATE_LIMIT_RAMP_UP_AFTER:
+                    state['rate'] = min(self.max_rate, state['rate'] + config.RATE_LIMIT_RAMP_UP_STEP)
+                    state['successes'] = 0
+
+    def observe(self, response: requests.Response):
+        # urllib3 のリトライで吸収された 429/503 も履歴から拾う
+        retries = getattr(response.raw, 'retries', None)
+        for history in getattr(retries, 'history', None) or []:
+            if history.status in THROTTLE_STATUS_CODES:
+                self.on_response(history.status)
+        retry_after = response.headers.get('Retry-After')
+        self.on_response(response.status_code, float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+    @property
+    def rate(self) -> float:
+        with self._locked_state() as state:
+            return state['rate']
+
+
+class HttpClient:
+    # コネクションを使い回し、一時的なエラーはバックオフ付きでリトライする
+    def __init__(self, pool_connections: int = config.HTTP_POOL_CONNECTIONS, pool_maxsize: int = config.HTTP_POOL_MAXSIZE,
+                 max_retries: int = config.HTTP_MAX_RETRIES, backoff_factor: float = config.HTTP_BACKOFF_FACTOR,
+                 backoff_jitter: float = config.HTTP_BACKOFF_JITTER, timeout: tuple = config.HTTP_TIMEOUT):
+        self.timeout = timeout
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, params: dict = None, stream: bool = False) -> requests.Response:
+        return self.session.get(url, params=params, stream=stream, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    # プロセス内で共有するHTTPクライアントを返す
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClient()
+    return _http_client
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(budget: str, requests_per_second: float) -> AdaptiveTokenBucket:
+    # budget: "metadata"（書類一覧API）または "download"（書類取得API）
+    # プロセス内では budget ごとに同じバケットを共有する
+    with _rate_limiters_lock:
+        if budget not in _rate_limiters:
+            settings = config.RATE_LIMITS[budget]
+            _rate_limiters[budget] = AdaptiveTokenBucket(
+                budget, requests_per_second, min_rate=settings['min_rate'], max_rate=settings['max_rate'], burst=settings['burst'],
+            )
+        return _rate_limiters[budget]
@@ -0,0 +1,225 @@
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+import config
+
+# 処理時間（秒）のヒストグラムの境界
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+METRIC_PREFIX = 'edinet_'
+
+
+class Histogram:
+    def __init__(self, buckets: list[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def to_dict(self) -> dict:
+        # Prometheus と同じく、各境界以下の件数を累積で持つ
+        cumulative = []
+        total = 0
+        for upper_bound, bucket_count in zip(self.buckets + ['+Inf'], self.bucket_counts):
+            total += bucket_count
+            cumulative.append((str(upper_bound), total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': dict(cumulative)}
+
+
+class MetricsRegistry:
+    # ステージや書類種別などのラベルごとにカウンタとヒストグラムを集計する
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.dump_thread = None
+        self.dump_stop = threading.Event()
+
+    def _key(self, name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None)))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        # ステージの処理時間を stage_seconds に、件数を stage_total に記録する
+        start_time = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start_time, stage=stage, **labels)
+            self.increment('stage_total', stage=stage, status=status, **labels)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.counters.items()]
+            histograms = [{'name': name, 'labels': dict(labels), **histogram.to_dict()} for (name, labels), histogram in self.histograms.items()]
+        return {'timestamp': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self) -> str:
+        def format_labels(labels: dict) -> str:
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        for counter in sorted(snapshot['counters'], key=lambda metric: metric['name']):
+            lines.append(f"{METRIC_PREFIX}{counter['name']}{format_labels(counter['labels'])} {counter['value']}")
+        for histogram in sorted(snapshot['histograms'], key=lambda metric: metric['name']):
+            name = f"{METRIC_PREFIX}{histogram['name']}"
+            for upper_bound, bucket_count in histogram['buckets'].items():
+                lines.append(f"{name}_bucket{format_labels({**histogram['labels'], 'le': upper_bound})} {bucket_count}")
+            lines.append(f"{name}_sum{format_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(histogram['labels'])} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_path: str = None):
+        # 拡張子が .prom の場合は Prometheus のテキスト形式、それ以外はJSONで書き出す
+        file_path = file_path or config.METRICS_PATH
+        if file_path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        # 読み取り側が書きかけのファイルを見ないよう、一時ファイルから置き換える
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, file_path)
+
+    def start_periodic_dump(self, file_path: str = None, interval: float = None):
+        file_path = file_path or config.METRICS_PATH
+        interval = interval or config.METRICS_DUMP_INTERVAL
+        if not file_path or self.dump_thread is not None:
+            return
+
+        def run():
+            while not self.dump_stop.wait(interval):
+                self.dump(file_path)
+
+        self.dump_stop.clear()
+        self.dump_thread = threading.Thread(target=run, daemon=True)
+        self.dump_thread.start()
+
+    def stop_periodic_dump(self, file_path: str = None):
+        # 停止時に最新の値を書き出す
+        file_path = file_path or config.METRICS_PATH
+        if self.dump_thread is None:
+            return
+        self.dump_stop.set()
+        self.dump_thread.join()
+        self.dump_thread = None
+        self.dump(file_path)
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    # プロセス内で共有するメトリクスを返す
+    return _metrics
+
+
+class SamplingProfiler:
+    # 一定間隔で全スレッドのスタックを取得し、関数ごとの出現回数を数える
+    # 出力は flamegraph.pl などで読める collapsed stack 形式
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_run(name: str, mode: str = None):
+    # mode: "cprofile" は呼び出したスレッドのみ、"sample" は全スレッドを対象にする
+    # 結果は LOG_PATH に書き出す
+    mode = mode or config.PROFILE
+    if not mode:
+        yield
+        return
+    file_prefix = os.path.join(config.LOG_PATH, f"profile_{name}_{int(time.time())}")
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{file_prefix}.prof")
+            with open(f"{file_prefix}.txt", 'w', encoding='utf-8') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(50)
+    elif mode == "sample":
+        profiler = SamplingProfiler(config.PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.write(f"{file_prefix}.collapsed")
+    else:
+        raise ValueError(f"Invalid profile mode: {mode}")
+
+
+def profiled(func):
+    # config.PROFILE が設定されている場合のみ、メソッドの実行をプロファイルする
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile_run(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
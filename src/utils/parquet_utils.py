@@ -0,0 +1,102 @@
+import os
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import config
+from src.common.logger import SimpleLogger
+from src.utils.sql_utils import SecuritiesReportTable
+
+
+class ParquetFactStore:
+    # 有価証券報告書のデータを fiscalYear / docTypeCode で分割したParquetデータセットとして保存する
+    partition_columns = ['fiscalYear', 'docTypeCode']
+    # 値の種類が多い列は辞書エンコードしない
+    plain_string_columns = ['value']
+    # パーティションごとに保存済みの docID を記録するファイル。"_" で始まるためデータセットの読み込みでは無視される
+    manifest_name = '_doc_ids.txt'
+
+    def __init__(self, root_path: str = config.PARQUET_PATH):
+        self.root_path = root_path
+        self.logger = SimpleLogger(__class__.__name__)
+        self.partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in self.partition_columns]), flavor='hive')
+        self.schema = pa.schema([self._field(column.name) for column in SecuritiesReportTable.__table__.columns])
+
+    def _field(self, column_name: str) -> pa.Field:
+        if column_name == 'numericValue':
+            return pa.field(column_name, pa.float64())
+        if column_name in self.partition_columns or column_name in self.plain_string_columns:
+            return pa.field(column_name, pa.string())
+        return pa.field(column_name, pa.dictionary(pa.int32(), pa.string()))
+
+    def write(self, combined_df: pd.DataFrame):
+        self.logger.info(f"start: write, rows: {len(combined_df)}")
+        if len(combined_df) == 0:
+            self.logger.info("end: write")
+            return
+        # 書類は docID ごとに不変なので、保存済みの書類は書き込まない
+        # 保存済みの docID は書き込み先のパーティションの一覧ファイルだけを見て判定する
+        partitions = combined_df[self.partition_columns].drop_duplicates().itertuples(index=False, name=None)
+        existing_doc_ids = set().union(*[self._get_existing_doc_ids(partition_values) for partition_values in partitions])
+        combined_df = combined_df[~combined_df['docID'].isin(existing_doc_ids)]
+        if len(combined_df) == 0:
+            self.logger.info("end: write, all documents already exist")
+            return
+        # 書き込みごとにファイル名を変え、既存のファイルには追記しない
+        write_df = combined_df.reindex(columns=self.schema.names)
+        write_df = write_df.astype({column_name: 'string' for column_name in self.schema.names if column_name != 'numericValue'})
+        write_df['numericValue'] = write_df['numericValue'].astype('float64')
+        table = pa.Table.from_pandas(write_df, preserve_index=False).cast(self.schema)
+        ds.write_dataset(
+            table,
+            self.root_path,
+            format='parquet',
+            partitioning=self.partitioning,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore',
+            file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+        )
+        for partition_values, partition_df in combined_df.groupby(self.partition_columns):
+            self._add_doc_ids(partition_values, partition_df['docID'].unique())
+        self.logger.info("end: write")
+
+    def _partition_path(self, partition_values: tuple) -> str:
+        return os.path.join(self.root_path, *[f"{column}={value}" for column, value in zip(self.partition_columns, partition_values)])
+
+    def _get_existing_doc_ids(self, partition_values: tuple) -> set:
+        partition_path = self._partition_path(partition_values)
+        manifest_path = os.path.join(partition_path, self.manifest_name)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                return set(f.read().split())
+        if not os.path.exists(partition_path):
+            return set()
+        # 一覧ファイルが無いパーティション（以前のバージョンで保存したもの）は一度だけ docID を読んで作る
+        doc_ids = ds.dataset(partition_path, format='parquet').to_table(columns=['docID']).column('docID')
+        doc_ids = set(doc_ids.unique().cast(pa.string()).to_pylist())
+        self._add_doc_ids(partition_values, doc_ids)
+        return doc_ids
+
+    def _add_doc_ids(self, partition_values: tuple, doc_ids):
+        with open(os.path.join(self._partition_path(partition_values), self.manifest_name), 'a', encoding='utf-8') as f:
+            f.writelines(f"{doc_id}\n" for doc_id in doc_ids)
+
+    def read(self, element_ids: list[str] = None, edinet_codes: list[str] = None, fiscal_years: list[str] = None, doc_type_codes: list[str] = None, columns: list[str] = None) -> pd.DataFrame:
+        # 条件と列の指定はデータセットのスキャン時に適用し、不要なパーティションや列を読まない
+        self.logger.info("start: read")
+        dataset = ds.dataset(self.root_path, format='parquet', partitioning=self.partitioning)
+        conditions = {
+            'elementId': element_ids,
+            'edinetCode': edinet_codes,
+            'fiscalYear': fiscal_years,
+            'docTypeCode': doc_type_codes,
+        }
+        expression = None
+        for column_name, values in conditions.items():
+            if values is None:
+                continue
+            condition = ds.field(column_name).isin(values)
+            expression = condition if expression is None else expression & condition
+        result_df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+        self.logger.info(f"end: read, rows: {len(result_df)}")
+        return result_df
@@ -0,0 +1,60 @@
+import queue
+import threading
+
+_STOP = object()
+
+
+def run_staged_pipeline(items: list, stages: list[tuple], queue_size: int = 8) -> tuple:
+    # items を各ステージの関数に順番に通す。ステージは (関数, 並列数) で指定する
+    # ステージ間はサイズ上限付きのキューでつなぎ、後段が詰まったら前段を待たせる
+    # 戻り値は入力順に並べた最終ステージの結果と、失敗した (index, 例外) のリスト
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    errors = []
+    errors_lock = threading.Lock()
+
+    def worker(func, in_queue, out_queue):
+        while True:
+            entry = in_queue.get()
+            if entry is _STOP:
+                break
+            index, item = entry
+            try:
+                result = func(item)
+            except Exception as e:
+                with errors_lock:
+                    errors.append((index, e))
+                continue
+            out_queue.put((index, result))
+
+    def feed():
+        for entry in enumerate(items):
+            queues[0].put(entry)
+        for _ in range(stages[0][1]):
+            queues[0].put(_STOP)
+
+    def close_stage(stage_index, threads):
+        # ステージの全スレッドが終わったら次段のスレッド数分だけ終了を伝える
+        for thread in threads:
+            thread.join()
+        next_workers = stages[stage_index + 1][1] if stage_index + 1 < len(stages) else 1
+        for _ in range(next_workers):
+            queues[stage_index + 1].put(_STOP)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for stage_index, (func, workers) in enumerate(stages):
+        stage_threads = [threading.Thread(target=worker, args=(func, queues[stage_index], queues[stage_index + 1]), daemon=True) for _ in range(workers)]
+        threads.extend(stage_threads)
+        threads.append(threading.Thread(target=close_stage, args=(stage_index, stage_threads), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # 最終ステージの結果を集約する
+    results = {}
+    while True:
+        entry = queues[-1].get()
+        if entry is _STOP:
+            break
+        index, result = entry
+        results[index] = result
+
+    return [results[index] for index in sorted(results)], sorted(errors, key=lambda error: error[0])
@@ -0,0 +1,142 @@
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy import inspect
+from src.common.logger import SimpleLogger
+from src.utils.sql_utils import get_engine
+
+LABEL_SEARCH_TABLE = 'label_search_index'
+
+# 日本語は分かち書きせずに検索できるよう trigram で索引を作る
+LABEL_SEARCH_TABLE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {LABEL_SEARCH_TABLE} USING fts5(
+    elementId UNINDEXED,
+    source UNINDEXED,
+    parentElementName UNINDEXED,
+    parentLabelJp UNINDEXED,
+    depth UNINDEXED,
+    labelJp,
+    labelEn,
+    verboseLabelJp,
+    verboseLabelEn,
+    classificationLabelJp,
+    classificationLabelEn,
+    tokenize = 'trigram'
+)
+"""
+
+# 検索対象のテーブルと、索引の各列に対応する列名
+LABEL_SOURCES = {
+    'tag': {
+        'table': 'tag_table',
+        'columns': {
+            'labelJp': 'standardLabelTree',
+            'labelEn': 'standardLabelEn',
+            'verboseLabelJp': 'verboseLabelJp',
+            'verboseLabelEn': 'verboseLabelEn',
+            'classificationLabelJp': 'classificationLabelJp',
+            'classificationLabelEn': 'classificationLabelEn',
+            'parentElementName': 'parentElementName',
+            'parentLabelJp': 'parentStandardLabelTree',
+            'depth': 'depth',
+        },
+    },
+    'account_tag': {
+        'table': 'account_tag_table',
+        'columns': {
+            'labelJp': 'standardLabel',
+            'labelEn': 'standardLabelEn',
+            'verboseLabelJp': 'verboseLabel',
+            'verboseLabelEn': 'verboseLabelEn',
+            'classificationLabelJp': 'classificationLabelJp',
+            'classificationLabelEn': 'classificationLabelEn',
+            'parentElementName': 'parentElementName',
+            'parentLabelJp': 'parentStandardLabel',
+            'depth': 'depth',
+        },
+    },
+}
+
+LABEL_COLUMNS = ['labelJp', 'labelEn', 'verboseLabelJp', 'verboseLabelEn', 'classificationLabelJp', 'classificationLabelEn']
+# bm25 の列ごとの重み。UNINDEXED の列も順番どおりに指定する
+LABEL_WEIGHTS = [0, 0, 0, 0, 0, 10.0, 10.0, 5.0, 5.0, 1.0, 1.0]
+# trigram で検索できる最短の文字数
+MIN_MATCH_LENGTH = 3
+
+
+class LabelSearchIndex:
+    # tag_table / account_tag_table のラベルを全文検索し、スコア順に要素IDを返す
+    def __init__(self, database_url: str):
+        self.engine = get_engine(database_url)
+        self.logger = SimpleLogger(__class__.__name__)
+        with self.engine.begin() as connection:
+            connection.execute(text(LABEL_SEARCH_TABLE_SQL))
+
+    def rebuild(self, source: str = None):
+        # source を指定した場合はそのテーブル分だけ入れ替える
+        self.logger.info(f"start: rebuild, source: {source}")
+        sources = [source] if source else list(LABEL_SOURCES)
+        existing_tables = inspect(self.engine).get_table_names()
+        with self.engine.begin() as connection:
+            for source_name in sources:
+                connection.execute(text(f"DELETE FROM {LABEL_SEARCH_TABLE} WHERE source = :source"), {"source": source_name})
+                source_table = LABEL_SOURCES[source_name]['table']
+                if source_table not in existing_tables:
+                    continue
+                column_mapping = LABEL_SOURCES[source_name]['columns']
+                index_columns = ', '.join(['elementId', 'source'] + list(column_mapping))
+                # 業種ごとに同じ要素が並ぶので要素IDごとに1行にまとめる
+                select_columns = ', '.join([f'"{column}"' for column in column_mapping.values()])
+                connection.execute(text(
+                    f"INSERT INTO {LABEL_SEARCH_TABLE} ({index_columns}) "
+                    f"SELECT elementId, :source, {select_columns} FROM \"{source_table}\" "
+                    f"WHERE elementId IS NOT NULL GROUP BY elementId"
+                ), {"source": source_name})
+        self.logger.info("end: rebuild")
+
+    def _match_expression(self, terms: list[str]) -> str:
+        # 利用者の入力をFTS5の構文として解釈させないよう、語句ごとに引用符で囲む
+        return ' AND '.join(['"' + term.replace('"', '""') + '"' for term in terms])
+
+    def search(self, query: str, limit: int = 20, source: str = None) -> pd.DataFrame:
+        self.logger.info(f"start: search, query: {query}")
+        terms = query.split()
+        if not terms:
+            return pd.DataFrame(columns=['elementId', 'source', 'labelJp', 'labelEn', 'parentElementName', 'parentLabelJp', 'depth', 'score'])
+        params = {"limit": limit}
+        source_condition = ""
+        if source:
+            source_condition = "AND source = :source"
+            params["source"] = source
+
+        if all(len(term) >= MIN_MATCH_LENGTH for term in terms):
+            weights = ', '.join([str(weight) for weight in LABEL_WEIGHTS])
+            params["match"] = self._match_expression(terms)
+            sql = (
+                f"SELECT elementId, source, labelJp, labelEn, parentElementName, parentLabelJp, depth, "
+                f"bm25({LABEL_SEARCH_TABLE}, {weights}) AS score "
+                f"FROM {LABEL_SEARCH_TABLE} WHERE {LABEL_SEARCH_TABLE} MATCH :match {source_condition}"
+            )
+        else:
+            # 2文字以下の語句は trigram で引けないので LIKE で探し、ラベルの短いものを上位にする
+            label_text = " || ' ' || ".join([f"coalesce({column}, '')" for column in LABEL_COLUMNS])
+            conditions = []
+            for i, term in enumerate(terms):
+                conditions.append(f"({label_text}) LIKE :term{i}")
+                params[f"term{i}"] = f"%{term}%"
+            sql = (
+                f"SELECT elementId, source, labelJp, labelEn, parentElementName, parentLabelJp, depth, "
+                f"length(labelJp) AS score "
+                f"FROM {LABEL_SEARCH_TABLE} WHERE {' AND '.join(conditions)} {source_condition}"
+            )
+        # tag と account_tag の両方にある要素は、スコアの良い方の1行だけを返す
+        # bm25 は全文検索のクエリ内でしか使えないため、先に結果を確定させてから集約する
+        sql = (
+            f"WITH matched AS MATERIALIZED ({sql}) "
+            f"SELECT elementId, source, labelJp, labelEn, parentElementName, parentLabelJp, depth, min(score) AS score "
+            f"FROM matched GROUP BY elementId ORDER BY score LIMIT :limit"
+        )
+
+        with self.engine.connect() as connection:
+            result_df = pd.read_sql(text(sql), connection, params=params)
+        self.logger.info(f"end: search, rows: {len(result_df)}")
+        return result_df
@@ -1,21 +1,32 @@
-from sqlalchemy import create_engine, Column, Integer, String, and_
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Index, and_, inspect, text, select, update as sa_update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 import config
 from src.common.logger import SimpleLogger
 from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import pandas as pd
+import threading
 
 Base = declarative_base()
+# ビューはテーブルとして作成しないよう、別のメタデータで管理する
+ViewBase = declarative_base()
 
 class SqlUtils:
+    # ロガーはインスタンスごとに作らず、全インスタンスで共有する
+    logger = None
+    logger_lock = threading.Lock()
+
     def __init__(self, database_url, model):
-        self.engine = create_engine(database_url)
-        self.session_factory = sessionmaker(bind=self.engine)
-        self.Session = scoped_session(self.session_factory)
+        # エンジンとセッションはDBのURLごとに共有する（スキーマの作成は初回のみ）
+        registry_entry = get_registry_entry(database_url)
+        self.engine = registry_entry['engine']
+        self.session_factory = registry_entry['session_factory']
+        self.Session = registry_entry['Session']
         self.model = model
-        self.logger = SimpleLogger(__class__.__name__)
-        # モデルクラスのメタデータをデータベースに作成
-        Base.metadata.create_all(self.engine)
+        with SqlUtils.logger_lock:
+            if SqlUtils.logger is None:
+                SqlUtils.logger = SimpleLogger(__class__.__name__)
 
     def add(self, **kwargs):
         self.logger.info(f"start: add, kwargs: {kwargs}")
@@ -49,10 +60,20 @@ class SqlUtils:
         if distinct:
             # Distinctを適用
             query = query.distinct()
+        conditions = self._build_conditions(filters)
+        # 全ての条件をand_で結合してfilterに適用
+        query = query.filter(and_(*conditions))
+        results = query.all()
+        # 共有しているセッションのトランザクションを残さない
+        self.Session.remove()
+        self.logger.info(f"end: get_with_compound_conditions")
+        return results
+
+    def _build_conditions(self, filters: dict) -> list:
         # その他の条件をconditionsリストに追加
         conditions = []
         for key, value in filters.items():
-            print(value)
+            self.logger.debug(value)
             attrib = getattr(self.model, key)
             if value["type"] == "date":
                 attrib = func.date(attrib)
@@ -72,12 +93,93 @@ class SqlUtils:
                 conditions.append(attrib == value["value"])
             else:
                 raise ValueError(f"Invalid type: {value['filter_type']}")
-            
-        # 全ての条件をand_で結合してfilterに適用
-        query = query.filter(and_(*conditions))
-        self.logger.info(f"end: get_with_compound_conditions")
-        return query.all()
+        return conditions
+
+    def _build_select(self, distinct=False, columns=None, **filters):
+        # ORMを介さないCoreのselect文を作る
+        table = self.model.__table__
+        statement = select(*[table.c[column] for column in columns]) if columns else select(table)
+        if distinct:
+            statement = statement.distinct()
+        return statement.where(and_(*self._build_conditions(filters)))
+
+    def iter_with_compound_conditions(self, batch_size: int = 1000, distinct=False, columns=None, **filters):
+        # batch_size 行ずつDBから取り出し、1行ずつ辞書形式で返す
+        self.logger.info(f"start: iter_with_compound_conditions, kwargs: {filters}")
+        statement = self._build_select(distinct=distinct, columns=columns, **filters)
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            for row in result.mappings():
+                yield row
+        self.logger.info(f"end: iter_with_compound_conditions")
+
+    def iter_dataframes(self, chunk_size: int = 100000, distinct=False, columns=None, **filters):
+        # chunk_size 行ずつのDataFrameを返す
+        self.logger.info(f"start: iter_dataframes, kwargs: {filters}")
+        statement = self._build_select(distinct=distinct, columns=columns, **filters)
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+            column_names = list(result.keys())
+            for rows in result.partitions():
+                yield pd.DataFrame.from_records(rows, columns=column_names)
+        self.logger.info(f"end: iter_dataframes")
+
+    def get_dataframe(self, distinct=False, columns=None, **filters) -> pd.DataFrame:
+        # 1行ずつオブジェクトに変換せず、結果をそのままDataFrameにする
+        self.logger.info(f"start: get_dataframe, kwargs: {filters}")
+        statement = self._build_select(distinct=distinct, columns=columns, **filters)
+        with self.engine.connect() as connection:
+            result_df = pd.read_sql(statement, connection)
+        self.logger.info(f"end: get_dataframe, rows: {len(result_df)}")
+        return result_df
     
+    def upsert(self, records: list[dict], chunk_size: int = 1000):
+        # 主キーが重複する行は更新、それ以外は挿入する
+        self.logger.info(f"start: upsert, count: {len(records)}")
+        self._bulk_insert(records, chunk_size, on_conflict="update")
+        self.logger.info(f"end: upsert")
+
+    def insert_or_ignore(self, records: list[dict], chunk_size: int = 1000) -> int:
+        # 主キーが重複する行は読み飛ばし、挿入した件数を返す
+        self.logger.info(f"start: insert_or_ignore, count: {len(records)}")
+        inserted_count = self._bulk_insert(records, chunk_size, on_conflict="ignore")
+        self.logger.info(f"end: insert_or_ignore, inserted: {inserted_count}")
+        return inserted_count
+
+    def _bulk_insert(self, records: list[dict], chunk_size: int, on_conflict: str) -> int:
+        table = self.model.__table__
+        primary_keys = [column.name for column in table.primary_key.columns]
+        inserted_count = 0
+        with self.engine.begin() as connection:
+            for i in range(0, len(records), chunk_size):
+                chunk = records[i:i + chunk_size]
+                statement = sqlite_insert(table)
+                if on_conflict == "update":
+                    update_columns = {key: statement.excluded[key] for key in chunk[0] if key not in primary_keys}
+                    statement = statement.on_conflict_do_update(index_elements=primary_keys, set_=update_columns)
+                else:
+                    # 主キー以外の一意制約（ディメンションテーブル）に対しても読み飛ばす
+                    statement = statement.on_conflict_do_nothing()
+                result = connection.execute(statement, chunk)
+                inserted_count += max(result.rowcount, 0)
+        return inserted_count
+
+    def update_in(self, key: str, values: list, chunk_size: int = 500, **kwargs):
+        # key の値が values に含まれる行をまとめて更新する
+        self.logger.info(f"start: update_in, key: {key}, count: {len(values)}")
+        attrib = getattr(self.model, key)
+        with self.engine.begin() as connection:
+            for i in range(0, len(values), chunk_size):
+                statement = sa_update(self.model.__table__).where(attrib.in_(values[i:i + chunk_size])).values(**kwargs)
+                connection.execute(statement)
+        self.logger.info(f"end: update_in")
+
+    def count_by(self, key: str) -> dict:
+        attrib = getattr(self.model, key)
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(attrib, func.count()).group_by(attrib)).all()
+        return {value: count for value, count in rows}
+
     def update(self, filters, **kwargs):
         self.logger.info(f"start: update, filters: {filters}, kwargs: {kwargs}")
         session = self.Session()
@@ -101,6 +203,10 @@ class SqlUtils:
 
 class DocumentListTable(Base):
     __tablename__ = 'document_list_table'
+    __table_args__ = (
+        Index('ix_document_list_edinet_code_doc_type_submit_date', 'edinetCode', 'docTypeCode', 'submitDate'),
+        Index('ix_document_list_submit_date_doc_type', 'submitDate', 'docTypeCode'),
+    )
 
     docID = Column(String, primary_key=True)
     edinetCode = Column(String)
@@ -130,19 +236,149 @@ class DocumentListTable(Base):
     englishDocFlag = Column(String)
     csvFlag = Column(String)
     legalStatus = Column(String)
+    # submitDateTime の日付部分 (YYYY-MM-DD)。date() を使わずにインデックスで検索するため
+    submitDate = Column(String)
     
-class SecuritiesReportTable(Base):
+class SecuritiesReportColumns:
+    docID = Column(String, primary_key=True)
+    edinetCode = Column(String, primary_key=True)
+    docTypeCode = Column(String)
+    fiscalYear = Column(String)
+    period = Column(String)
+    filePrefix = Column(String)
+    elementId = Column(String, primary_key=True)
+    itemName = Column(String)
+    contextId = Column(String, primary_key=True)
+    relativeFiscalYear = Column(String)
+    consolidatedOrIndividual = Column(String)
+    periodOrPointInTime = Column(String)
+    unitId = Column(String)
+    unit = Column(String)
+    value = Column(String)
+    submitDateTime = Column(String)
+    # value を数値に変換し、unit の倍率を反映した値
+    numericValue = Column(Float)
+    normalizedUnit = Column(String)
+
+class SecuritiesReportTable(SecuritiesReportColumns, Base):
     __tablename__ = 'securities_report_table'
+    __table_args__ = (
+        Index('ix_securities_report_edinet_code_element_id', 'edinetCode', 'elementId', 'fiscalYear', 'relativeFiscalYear', 'period'),
+        Index('ix_securities_report_element_id_fiscal_year', 'elementId', 'fiscalYear'),
+    )
+
+class SecuritiesReportView(SecuritiesReportColumns, ViewBase):
+    # 正規化したテーブルを結合し、securities_report_table と同じ形で参照するビュー
+    __tablename__ = 'securities_report_view'
+
+class ElementDimTable(Base):
+    __tablename__ = 'element_dim_table'
+    __table_args__ = (
+        Index('ux_element_dim', 'elementId', 'itemName', unique=True),
+    )
+
+    elementKey = Column(Integer, primary_key=True)
+    elementId = Column(String)
+    itemName = Column(String)
+
+class ContextDimTable(Base):
+    __tablename__ = 'context_dim_table'
+    __table_args__ = (
+        Index('ux_context_dim', 'contextId', 'relativeFiscalYear', 'consolidatedOrIndividual', 'periodOrPointInTime', unique=True),
+    )
+
+    contextKey = Column(Integer, primary_key=True)
+    contextId = Column(String)
+    relativeFiscalYear = Column(String)
+    consolidatedOrIndividual = Column(String)
+    periodOrPointInTime = Column(String)
+
+class UnitDimTable(Base):
+    __tablename__ = 'unit_dim_table'
+    __table_args__ = (
+        Index('ux_unit_dim', 'unitId', 'unit', 'normalizedUnit', unique=True),
+    )
+
+    unitKey = Column(Integer, primary_key=True)
+    unitId = Column(String)
+    unit = Column(String)
+    normalizedUnit = Column(String)
+
+class SecuritiesReportFactTable(Base):
+    __tablename__ = 'securities_report_fact_table'
+    __table_args__ = (
+        Index('ix_securities_report_fact_edinet_code_element_key', 'edinetCode', 'elementKey', 'fiscalYear', 'period'),
+        Index('ix_securities_report_fact_element_key_fiscal_year', 'elementKey', 'fiscalYear'),
+    )
 
     docID = Column(String, primary_key=True)
     edinetCode = Column(String, primary_key=True)
+    elementKey = Column(Integer, primary_key=True)
+    contextKey = Column(Integer, primary_key=True)
+    unitKey = Column(Integer)
     docTypeCode = Column(String)
     fiscalYear = Column(String)
     period = Column(String)
     filePrefix = Column(String)
+    value = Column(String)
+    numericValue = Column(Float)
+    submitDateTime = Column(String)
+
+# (ディメンションテーブル, キーのカラム, 値のカラム)
+# 値のカラムは一意制約のためNULLの代わりに空文字で保存する
+DIMENSION_TABLES = [
+    (ElementDimTable, 'elementKey', ['elementId', 'itemName']),
+    (ContextDimTable, 'contextKey', ['contextId', 'relativeFiscalYear', 'consolidatedOrIndividual', 'periodOrPointInTime']),
+    (UnitDimTable, 'unitKey', ['unitId', 'unit', 'normalizedUnit']),
+]
+
+SECURITIES_REPORT_VIEW_SQL = """
+CREATE VIEW IF NOT EXISTS securities_report_view AS
+SELECT
+    f.docID AS docID,
+    f.edinetCode AS edinetCode,
+    f.docTypeCode AS docTypeCode,
+    f.fiscalYear AS fiscalYear,
+    f.period AS period,
+    f.filePrefix AS filePrefix,
+    e.elementId AS elementId,
+    NULLIF(e.itemName, '') AS itemName,
+    c.contextId AS contextId,
+    NULLIF(c.relativeFiscalYear, '') AS relativeFiscalYear,
+    NULLIF(c.consolidatedOrIndividual, '') AS consolidatedOrIndividual,
+    NULLIF(c.periodOrPointInTime, '') AS periodOrPointInTime,
+    NULLIF(u.unitId, '') AS unitId,
+    NULLIF(u.unit, '') AS unit,
+    f.value AS value,
+    f.submitDateTime AS submitDateTime,
+    f.numericValue AS numericValue,
+    NULLIF(u.normalizedUnit, '') AS normalizedUnit
+FROM securities_report_fact_table f
+JOIN element_dim_table e ON e.elementKey = f.elementKey
+JOIN context_dim_table c ON c.contextKey = f.contextKey
+LEFT JOIN unit_dim_table u ON u.unitKey = f.unitKey
+"""
+
+class LatestFactTable(Base):
+    # 訂正報告書を反映し、(企業, 年度, 期間, 要素, コンテキスト) ごとに最新の提出の値だけを持つ
+    __tablename__ = 'latest_fact_table'
+    __table_args__ = (
+        Index('ix_latest_fact_element_id_fiscal_year', 'elementId', 'fiscalYear'),
+        # 訂正元ごとの最新の提出日時をインデックスだけで求める
+        Index('ix_latest_fact_root_doc_id', 'rootDocID', 'docSubmitDateTime'),
+    )
+
+    edinetCode = Column(String, primary_key=True)
+    fiscalYear = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)
     elementId = Column(String, primary_key=True)
-    itemName = Column(String)
     contextId = Column(String, primary_key=True)
+    docID = Column(String)
+    # 訂正報告書の場合は訂正元の docID (parentDocID)、それ以外は自身の docID
+    rootDocID = Column(String)
+    docTypeCode = Column(String)
+    filePrefix = Column(String)
+    itemName = Column(String)
     relativeFiscalYear = Column(String)
     consolidatedOrIndividual = Column(String)
     periodOrPointInTime = Column(String)
@@ -150,6 +386,32 @@ class SecuritiesReportTable(Base):
     unit = Column(String)
     value = Column(String)
     submitDateTime = Column(String)
+    # document_list_table の提出日時（時刻まで含む）。同じ日に提出された書類の前後を判定する
+    docSubmitDateTime = Column(String)
+    numericValue = Column(Float)
+    normalizedUnit = Column(String)
+
+class SyncStateTable(Base):
+    __tablename__ = 'sync_state_table'
+
+    syncName = Column(String, primary_key=True)
+    lastSyncedDate = Column(String)
+    lastOpeDateTime = Column(String)
+    updatedAt = Column(String)
+
+class IngestJobTable(Base):
+    __tablename__ = 'ingest_job_table'
+    __table_args__ = (
+        Index('ix_ingest_job_stage', 'stage'),
+    )
+
+    docID = Column(String, primary_key=True)
+    edinetCode = Column(String)
+    # pending / started / downloaded / parsed / stored / failed
+    stage = Column(String)
+    attempts = Column(Integer)
+    lastError = Column(String)
+    updatedAt = Column(String)
 
 class EdinetcodeTable(Base):
     __tablename__ = 'edinetcode_table'
@@ -169,6 +431,124 @@ class EdinetcodeTable(Base):
     corporateNumber = Column(String)
 
 
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in config.SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def get_registry_entry(database_url: str) -> dict:
+    with _registry_lock:
+        if database_url not in _registry:
+            engine = create_engine(database_url)
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _set_sqlite_pragmas)
+            # モデルクラスのメタデータをデータベースに作成
+            Base.metadata.create_all(engine)
+            migrate(engine)
+            session_factory = sessionmaker(bind=engine)
+            _registry[database_url] = {
+                'engine': engine,
+                'session_factory': session_factory,
+                'Session': scoped_session(session_factory),
+            }
+        return _registry[database_url]
+
+
+def get_engine(database_url: str):
+    return get_registry_entry(database_url)['engine']
+
+
+def migrate(engine):
+    # 既存のDBに不足しているカラムとインデックスを追加する
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                if table.name == DocumentListTable.__tablename__ and column.name == 'submitDate':
+                    connection.execute(text('UPDATE document_list_table SET submitDate = substr(submitDateTime, 1, 10)'))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        connection.execute(text(SECURITIES_REPORT_VIEW_SQL))
+
+
+def get_securities_report_model():
+    # 正規化スキーマを使う場合はビューを参照する
+    return SecuritiesReportView if config.NORMALIZED_SCHEMA else SecuritiesReportTable
+
+
+def refresh_latest_facts(engine, doc_ids: list[str], source_table: str = None, chunk_size: int = 500) -> None:
+    # 保存した書類の分だけ latest_fact_table を更新する。既存の行は提出日時が新しい場合のみ置き換える
+    # 訂正報告書が入った場合は、訂正元から残っている古い値（訂正後に無くなった要素）を削除する
+    source_table = source_table or get_securities_report_model().__tablename__
+    key_columns = [column.name for column in LatestFactTable.__table__.primary_key.columns]
+    fact_columns = [column.name for column in LatestFactTable.__table__.columns if column.name not in ('rootDocID', 'docSubmitDateTime')]
+    update_columns = [column.name for column in LatestFactTable.__table__.columns if column.name not in key_columns]
+    for start in range(0, len(doc_ids), chunk_size):
+        chunk = doc_ids[start:start + chunk_size]
+        params = {f"doc_id_{i}": doc_id for i, doc_id in enumerate(chunk)}
+        placeholders = ', '.join(f":doc_id_{i}" for i in range(len(chunk)))
+        with engine.begin() as connection:
+            connection.execute(text(
+                f"INSERT INTO latest_fact_table ({', '.join(fact_columns)}, rootDocID, docSubmitDateTime) "
+                f"SELECT {', '.join(f's.{column}' for column in fact_columns)}, "
+                f"COALESCE(d.parentDocID, s.docID), COALESCE(d.submitDateTime, s.submitDateTime) "
+                f"FROM {source_table} s LEFT JOIN document_list_table d ON d.docID = s.docID "
+                f"WHERE s.docID IN ({placeholders}) "
+                f"ORDER BY COALESCE(d.submitDateTime, s.submitDateTime) "
+                f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET "
+                f"{', '.join(f'{column} = excluded.{column}' for column in update_columns)} "
+                f"WHERE excluded.docSubmitDateTime >= latest_fact_table.docSubmitDateTime"
+            ), params)
+            connection.execute(text(
+                f"DELETE FROM latest_fact_table "
+                f"WHERE rootDocID IN (SELECT COALESCE(d.parentDocID, d.docID) FROM document_list_table d WHERE d.docID IN ({placeholders})) "
+                f"AND docSubmitDateTime < (SELECT MAX(l.docSubmitDateTime) FROM latest_fact_table l WHERE l.rootDocID = latest_fact_table.rootDocID)"
+            ), params)
+
+
+def lookup_dimension_keys(engine, model, key_column: str, values_df: pd.DataFrame) -> pd.DataFrame:
+    # ディメンションテーブル全体は読まず、values_df にある値の組み合わせの分だけ整数キーを引く
+    # 値は一時テーブルに入れ、ディメンションテーブルのユニークインデックスで結合する
+    value_columns = list(values_df.columns)
+    if values_df.empty:
+        return pd.DataFrame(columns=value_columns + [key_column])
+    temp_table = f"{model.__tablename__}_lookup"
+    join_conditions = ' AND '.join(f"d.{column} = t.{column}" for column in value_columns)
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS temp.{temp_table}"))
+        connection.execute(text(f"CREATE TEMP TABLE {temp_table} ({', '.join(f'{column} TEXT' for column in value_columns)})"))
+        connection.execute(text(
+            f"INSERT INTO temp.{temp_table} ({', '.join(value_columns)}) VALUES ({', '.join(f':{column}' for column in value_columns)})"
+        ), df_to_records(values_df))
+        rows = connection.execute(text(
+            f"SELECT {', '.join(f't.{column}' for column in value_columns)}, d.{key_column} "
+            f"FROM temp.{temp_table} t JOIN {model.__tablename__} d ON {join_conditions}"
+        )).fetchall()
+        connection.execute(text(f"DROP TABLE temp.{temp_table}"))
+    return pd.DataFrame(rows, columns=value_columns + [key_column])
+
+
+def df_to_records(df: pd.DataFrame, columns: list[str] = None) -> list[dict]:
+    # NaNをNoneに置き換えてDBに渡せる形にする
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict('records')
+
+
 # 使用例
 if __name__ == "__main__":
     database_url = f'sqlite:///{config.EDINET_DB}'
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+import config
+from src.common.logger import SimpleLogger
+
+TAG_COLUMN_NAME_MAPPING = {
+    '様式ツリー-標準ラベル（日本語）': 'standardLabelTree',
+    '詳細ツリー-標準ラベル（日本語）': 'detailedLabelTree',
+    '冗長ラベル（日本語）': 'verboseLabelJp',
+    '標準ラベル（英語）': 'standardLabelEn',
+    '冗長ラベル（英語）': 'verboseLabelEn',
+    '用途区分、財務諸表区分及び業種区分のラベル（日本語）': 'classificationLabelJp',
+    '用途区分、財務諸表区分及び業種区分のラベル（英語）': 'classificationLabelEn',
+    '名前空間プレフィックス': 'namespacePrefix',
+    '要素名': 'elementName',
+    'elementId': 'elementId',
+    'type': 'type',
+    'substitutionGroup': 'substitutionGroup',
+    'periodType': 'periodType',
+    'balance': 'balance',
+    'abstract': 'abstract',
+    'depth': 'depth',
+    'documentationラベル（日本語）': 'documentationLabelJp',
+    'documentationラベル（英語）': 'documentationLabelEn',
+    '参照リンク': 'referenceLink',
+    'Document Information': 'documentInformation',
+    'parentElementName': 'parentElementName',
+    'parentStandardLabelTree': 'parentStandardLabelTree',
+    'parentDetailedLabelTree': 'parentDetailedLabelTree',
+    'submitDateTime': 'submitDateTime'
+}
+
+ACCOUNT_TAG_COLUMN_NAME_MAPPING = {
+    '科目分類': 'accountClassification',
+    'industry': 'industry',
+    '標準ラベル（日本語）': 'standardLabel',
+    '冗長ラベル（日本語）': 'verboseLabel',
+    '標準ラベル（英語）': 'standardLabelEn',
+    '冗長ラベル（英語）': 'verboseLabelEn',
+    '用途区分、財務諸表区分及び業種区分のラベル（日本語）': 'classificationLabelJp',
+    '用途区分、財務諸表区分及び業種区分のラベル（英語）': 'classificationLabelEn',
+    '名前空間プレフィックス': 'namespacePrefix',
+    '要素名': 'elementName',
+    'type': 'type',
+    'substitutionGroup': 'substitutionGroup',
+    'periodType': 'periodType',
+    'balance': 'balance',
+    'abstract': 'abstract',
+    'depth': 'depth',
+    '参照リンク': 'referenceLink',
+    'parentElementName': 'parentElementName',
+    'parentStandardLabel': 'parentStandardLabel',
+    'submitDateTime': 'submitDateTime'
+}
+
+ACCOUNT_TYPE_LIST = [
+    "貸借対照表　科目一覧",
+    "損益計算書　科目一覧",
+    "包括利益計算書　科目一覧",
+    "株主資本等変動計算書　科目一覧",
+    "キャッシュ・フロー計算書　科目一覧",
+    "社員資本等変動計算書　科目一覧",
+    "投資主資本等変動計算書　科目一覧",
+    "純資産変動計算書　科目一覧",
+    "損益及び剰余金計算書　科目一覧",
+]
+
+ACCOUNT_SKIP_SHEET_LIST = ['目次', '勘定科目リストについて']
+
+# 要素IDのインデックスの元になるテーブル。同じ要素が両方にある場合は先に書いた方を優先する
+ELEMENT_INDEX_TABLES = {
+    'tag': 'tag_table',
+    'account_tag': 'account_tag_table',
+}
+
+# 要素IDのインデックスに持たせる項目と、各テーブルでの列名
+ELEMENT_INDEX_COLUMNS = {
+    'tag': {
+        'labelJp': 'standardLabelTree',
+        'labelEn': 'standardLabelEn',
+        'verboseLabelJp': 'verboseLabelJp',
+        'verboseLabelEn': 'verboseLabelEn',
+        'parentElementName': 'parentElementName',
+        'parentLabelJp': 'parentStandardLabelTree',
+        'depth': 'depth',
+    },
+    'account_tag': {
+        'labelJp': 'standardLabel',
+        'labelEn': 'standardLabelEn',
+        'verboseLabelJp': 'verboseLabel',
+        'verboseLabelEn': 'verboseLabelEn',
+        'parentElementName': 'parentElementName',
+        'parentLabelJp': 'parentStandardLabel',
+        'depth': 'depth',
+    },
+}
+
+
+def clean_label_columns(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    # Excel由来の改行コードと連続する空白を1つの空白にそろえる
+    for column in columns:
+        df[column] = df[column].str.replace('_x000D_', ' ').replace(r'\s+|\\n', ' ', regex=True)
+    return df
+
+
+def build_tag_df(file_path: str) -> pd.DataFrame:
+    tag_df = pd.read_excel(file_path, sheet_name="9", header=1)
+    tag_df.dropna(how='all', subset=['要素名'], inplace=True)
+    tag_df.dropna(how='all', inplace=True)
+    tag_df = tag_df.ffill()
+
+    tag_df.rename(columns=TAG_COLUMN_NAME_MAPPING, inplace=True)
+    tag_df['parentElementName'] = np.where(tag_df['depth'] == 0, tag_df['elementName'], np.nan)
+    tag_df['parentStandardLabelTree'] = np.where(tag_df['depth'] == 0, tag_df['standardLabelTree'], np.nan)
+    tag_df['parentDetailedLabelTree'] = np.where(tag_df['depth'] == 0, tag_df['detailedLabelTree'], np.nan)
+    tag_df['parentElementName'] = tag_df['parentElementName'].ffill()
+    tag_df['parentStandardLabelTree'] = tag_df['parentStandardLabelTree'].ffill()
+    tag_df['parentDetailedLabelTree'] = tag_df['parentDetailedLabelTree'].ffill()
+    tag_df['elementId'] = tag_df['namespacePrefix'] + ':' + tag_df['elementName']
+    return clean_label_columns(tag_df, ['classificationLabelJp', 'classificationLabelEn', 'referenceLink'])
+
+
+def build_account_tag_df(file_path: str) -> pd.DataFrame:
+    # sheet_name=None で全シートを1回の読み込みで取得する
+    sheets = pd.read_excel(file_path, sheet_name=None, header=1, engine='openpyxl')
+
+    account_df_list = []
+    for sheet_name, _account_df in sheets.items():
+        if sheet_name in ACCOUNT_SKIP_SHEET_LIST:
+            continue
+        _account_df = _account_df[~_account_df['科目分類'].isin(ACCOUNT_TYPE_LIST + ['科目分類'] + [np.nan])].copy()
+        _account_df['industry'] = sheet_name
+        account_df_list.append(_account_df)
+
+    account_df = pd.concat(account_df_list)
+    account_df.rename(columns=ACCOUNT_TAG_COLUMN_NAME_MAPPING, inplace=True)
+    account_df['parentElementName'] = np.where(account_df['depth'] == 0, account_df['elementName'], np.nan)
+    account_df['parentStandardLabel'] = np.where(account_df['depth'] == 0, account_df['standardLabel'], np.nan)
+    account_df['parentElementName'] = account_df['parentElementName'].ffill()
+    account_df['parentStandardLabel'] = account_df['parentStandardLabel'].ffill()
+    account_df['elementId'] = account_df['namespacePrefix'] + ':' + account_df['elementName']
+    return clean_label_columns(account_df, ['classificationLabelJp', 'classificationLabelEn', 'referenceLink'])
+
+
+class TaxonomyLoader:
+    # タクソノミのExcelを1回だけ解析し、ファイルのハッシュをキーにpickleでキャッシュする
+    builders = {
+        'tag': build_tag_df,
+        'account_tag': build_account_tag_df,
+    }
+
+    def __init__(self, cache_path: str = config.TAXONOMY_CACHE_PATH):
+        self.cache_path = cache_path
+        self.logger = SimpleLogger(__class__.__name__)
+        self.lock = threading.Lock()
+        self.tables = {}
+        # elementId → ラベル・親要素・深さ。種類ごとに (テーブルの版, インデックス) を持つ
+        self.element_indexes = {}
+        self.element_index = {}
+        os.makedirs(cache_path, exist_ok=True)
+
+    def _file_hash(self, file_path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def load(self, kind: str, file_path: str) -> pd.DataFrame:
+        self.logger.info(f"start: load, kind: {kind}, file_path: {file_path}")
+        file_hash = self._file_hash(file_path)
+        cache_file_path = os.path.join(self.cache_path, f"{kind}_{file_hash}.pkl")
+        with self.lock:
+            if (kind, file_hash) not in self.tables:
+                if os.path.exists(cache_file_path):
+                    self.logger.info(f"cache hit: {cache_file_path}")
+                    taxonomy_df = pd.read_pickle(cache_file_path)
+                else:
+                    taxonomy_df = self.builders[kind](file_path)
+                    taxonomy_df.to_pickle(cache_file_path)
+                self.tables[(kind, file_hash)] = taxonomy_df
+            taxonomy_df = self.tables[(kind, file_hash)]
+        self.logger.info("end: load")
+        return taxonomy_df.copy()
+
+    def load_tag_table(self, file_path: str) -> pd.DataFrame:
+        return self.load('tag', file_path)
+
+    def load_account_tag_table(self, file_path: str) -> pd.DataFrame:
+        return self.load('account_tag', file_path)
+
+    def get_element_index(self, engine) -> dict:
+        # tag_table / account_tag_table から必要になった時点で作り、テーブルが保存し直された場合は作り直す
+        # どのプロセスでも同じ内容になるよう、読み込んだExcelではなくDBのテーブルを元にする
+        with self.lock:
+            existing_tables = inspect(engine).get_table_names()
+            is_changed = False
+            with engine.connect() as connection:
+                for kind, table_name in ELEMENT_INDEX_TABLES.items():
+                    version = None
+                    if table_name in existing_tables:
+                        # 保存時に全行へ同じ submitDateTime を入れるので、件数と合わせて版として使う
+                        version = (str(engine.url),) + tuple(connection.execute(text(f'SELECT max(submitDateTime), count(*) FROM "{table_name}"')).one())
+                    if kind in self.element_indexes and self.element_indexes[kind][0] == version:
+                        continue
+                    element_index = {}
+                    if version is not None:
+                        column_mapping = ELEMENT_INDEX_COLUMNS[kind]
+                        select_columns = ', '.join([f'"{column}"' for column in column_mapping.values()])
+                        index_df = pd.read_sql(text(f'SELECT elementId, {select_columns} FROM "{table_name}" WHERE elementId IS NOT NULL'), connection)
+                        element_index = self._build_element_index(kind, index_df)
+                    self.element_indexes[kind] = (version, element_index)
+                    is_changed = True
+            if is_changed:
+                self.element_index = {}
+                for kind in reversed(list(ELEMENT_INDEX_TABLES)):
+                    self.element_index.update(self.element_indexes[kind][1])
+            return self.element_index
+
+    def _build_element_index(self, kind: str, taxonomy_df: pd.DataFrame) -> dict:
+        column_mapping = ELEMENT_INDEX_COLUMNS[kind]
+        index_df = taxonomy_df[['elementId'] + list(column_mapping.values())].drop_duplicates(subset=['elementId'])
+        index_df = index_df.rename(columns={column: key for key, column in column_mapping.items()})
+        index_df = index_df.astype(object).where(index_df.notna(), None)
+        return index_df.set_index('elementId').to_dict('index')
+
+
+_taxonomy_loader = None
+_taxonomy_loader_lock = threading.Lock()
+
+
+def get_taxonomy_loader() -> TaxonomyLoader:
+    # プロセス内で共有するローダーを返す
+    global _taxonomy_loader
+    with _taxonomy_loader_lock:
+        if _taxonomy_loader is None:
+            _taxonomy_loader = TaxonomyLoader()
+    return _taxonomy_loader